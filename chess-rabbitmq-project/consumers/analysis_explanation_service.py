@@ -0,0 +1,416 @@
+r"""
+analysis_explanation_service.py
+
+Ce fichier définit un service combinant l’analyse et l’explication des coups.
+
+Il remplace le couple analysis_service + explanation_service
+lorsque les deux tournent sur la même machine.
+
+Le résultat de Stockfish est transmis directement à l’IA,
+sans attendre l’aller-retour de l’événement analysis par RabbitMQ.
+Les événements analysis et move_explained sont tout de même diffusés
+pour les autres services.
+
+Ce service est passif.
+Il ne joue pas.
+Il ne valide pas.
+Il ne modifie jamais la partie officielle.
+"""
+
+# Bibliothèque pour communiquer avec RabbitMQ
+import pika
+
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
+
+# Bibliothèque python-chess pour gérer le plateau et les coups
+import chess
+
+# Interface avec le moteur Stockfish
+import chess.engine
+
+# Accès au système de fichiers
+import os
+
+# Sauvegarde du cache des explications à l’arrêt du service
+import atexit
+
+# File des messages en cours de traitement, dans l’ordre de réception
+from collections import deque
+
+# Service d’analyse
+# Sa table de transposition et son thread Stockfish sont réutilisés
+import analysis_service
+
+# Service d’explication
+# Son client OpenAI, son cache et son pool de threads sont réutilisés
+import explanation_service
+
+
+# Exchange commun à tous les services
+EXCHANGE_NAME = "chess.events"
+
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    event_type: pika.BasicProperties(headers={"event_type": event_type})
+    for event_type in ("analysis", "move_explained")
+}
+
+# Mêmes propriétés pour les messages compressés avec zstd
+COMPRESSED_PUBLISH_PROPERTIES = {
+    event_type: pika.BasicProperties(
+        content_encoding=broker.ZSTD_CONTENT_ENCODING,
+        headers={"event_type": event_type}
+    )
+    for event_type in ("analysis", "move_explained")
+}
+
+
+# Nombre maximal de messages non acquittés confiés à ce consommateur
+# Aligné sur le service d’explication, l’étape la plus lente
+PREFETCH_COUNT = explanation_service.PREFETCH_COUNT
+
+
+# Plateau local reconstruit à partir des coups validés
+board = chess.Board()
+
+# Connexion et canal RabbitMQ globaux
+connection = None
+channel = None
+
+# Identifiant de la partie en cours
+# Il change à chaque nouvelle partie pour que Stockfish reçoive ucinewgame
+game_id = 0
+
+# Analyse de la position courante
+# Elle sert de contexte à l’explication du coup suivant
+# comme la dernière analyse reçue dans explanation_service
+last_analysis = None
+
+# Messages reçus dont le traitement n’est pas terminé
+# Chaque élément est un dictionnaire décrivant le message
+pending_deliveries = deque()
+
+
+def publish(event_type, payload):
+    """
+    Publie un événement vers RabbitMQ.
+
+    event_type indique le type d’événement.
+    payload contient les données associées.
+    """
+
+    body = explanation_service.json_codec.dumps({
+        "event_type": event_type,
+        "payload": payload
+    })
+    properties = PUBLISH_PROPERTIES[event_type]
+
+    # Les messages volumineux sont compressés
+    # comme dans explanation_service
+    compressed = explanation_service.compress_body(body)
+
+    if compressed is not None:
+        body = compressed
+        properties = COMPRESSED_PUBLISH_PROPERTIES[event_type]
+
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=properties
+            )
+            return
+        except pika.exceptions.NackError:
+            print("Événement refusé par RabbitMQ, nouvelle tentative")
+
+    print("Événement non publié :", event_type)
+
+
+def explain_move(previous_analysis, uci, position):
+    """
+    Génère l’explication d’un coup à partir de l’analyse précédente.
+
+    previous_analysis est l’analyse de la position avant le coup.
+    Elle vaut None pour le premier coup de la partie.
+    uci est le coup joué.
+    position est une copie du plateau après le coup.
+
+    Cette fonction s’exécute dans le pool de threads de l’IA.
+    """
+
+    score = 0.0
+    best_move = "—"
+
+    # Attente du résultat de Stockfish, sans passer par RabbitMQ
+    # Une analyse en échec laisse les valeurs par défaut
+    if previous_analysis is not None:
+        try:
+            result = previous_analysis.result()
+        except Exception as error:
+            print("Analyse impossible :", error)
+        else:
+            score = result["score"]
+            best_move = result["best_move"]
+
+    return explanation_service.call_llm(uci, score, best_move, position)
+
+
+def complete_deliveries():
+    """
+    Diffuse les résultats terminés dans l’ordre des coups.
+
+    Cette fonction s’exécute dans le thread de RabbitMQ.
+    Les analyses sont diffusées dès qu’elles sont prêtes.
+    Un message n’est acquitté qu’après la diffusion de son explication.
+    """
+
+    # Diffusion des analyses terminées
+    for delivery in pending_deliveries:
+        future = delivery["analysis"]
+
+        if future is None or delivery["analysis_published"]:
+            continue
+
+        # Les analyses suivantes attendent celle-ci
+        if not future.done():
+            break
+
+        # Une analyse en échec est remplacée par une analyse neutre
+        # pour que le coup soit tout de même diffusé et acquitté
+        try:
+            result = future.result()
+        except Exception as error:
+            print("Analyse impossible :", error)
+            result = {"score": 0.0, "best_move": "—", "text": "—"}
+
+        publish("analysis", result)
+        delivery["analysis_published"] = True
+
+    # Diffusion des explications et acquittement
+    while pending_deliveries:
+        delivery = pending_deliveries[0]
+        analysis_future = delivery["analysis"]
+        explanation_future = delivery["explanation"]
+
+        # Traitement encore en cours pour ce message
+        if analysis_future is not None and not delivery["analysis_published"]:
+            break
+        if explanation_future is not None and not explanation_future.done():
+            break
+
+        pending_deliveries.popleft()
+
+        if explanation_future is not None:
+            # Une explication en échec, par exemple une erreur de l’API,
+            # est remplacée par un tiret
+            try:
+                text = explanation_future.result()
+            except Exception as error:
+                print("Explication impossible :", error)
+                text = "—"
+
+            publish(
+                "move_explained",
+                {
+                    "uci": delivery["uci"],
+                    "text": text
+                }
+            )
+
+        channel.basic_ack(delivery_tag=delivery["delivery_tag"])
+
+
+def on_job_done(future):
+    """
+    Appelée par les threads de calcul quand un résultat est prêt.
+
+    pika n’étant pas thread-safe,
+    la diffusion est confiée au thread de RabbitMQ.
+    """
+
+    connection.add_callback_threadsafe(complete_deliveries)
+
+
+def on_message(ch, method, properties, body):
+    """
+    Traite les événements reçus depuis RabbitMQ.
+
+    Cette fonction
+    reconstruit la partie localement
+    lance l’analyse puis l’explication après chaque coup validé
+    acquitte les messages une fois traités
+    """
+
+    global game_id, last_analysis
+
+    delivery = {
+        "delivery_tag": method.delivery_tag,
+        "uci": None,
+        "analysis": None,
+        "explanation": None,
+        "analysis_published": False
+    }
+
+    # Événement sans intérêt pour l’analyse
+    # Il rejoint la file sans décoder son corps pour être acquitté dans l’ordre
+    if broker.is_ignored_event(properties, analysis_service.HANDLED_EVENTS):
+        pending_deliveries.append(delivery)
+        complete_deliveries()
+        return
+
+    # Décodage du message
+    # Lecture du type d’événement et des données associées
+    event_type, payload = broker.decode_event(properties, body)
+
+    # Début d’une nouvelle partie
+    if event_type == "game_started":
+        board.reset()
+        game_id += 1
+        last_analysis = None
+
+    # Coup validé par le service de validation
+    elif event_type == "move_validated":
+        uci = payload["uci"]
+        board.push(analysis_service.parse_uci(uci))
+
+        # Copie du plateau partagée par les deux calculs
+        position = board.copy()
+
+        # Analyse Stockfish dans le thread dédié
+        analysis_future = analysis_service.executor.submit(
+            analysis_service.analyse_position,
+            position,
+            game_id
+        )
+
+        # Explication dans le pool de l’IA
+        # Elle utilise l’analyse de la position précédant le coup
+        explanation_future = explanation_service.executor.submit(
+            explain_move,
+            last_analysis,
+            uci,
+            position
+        )
+
+        last_analysis = analysis_future
+
+        delivery["uci"] = uci
+        delivery["analysis"] = analysis_future
+        delivery["explanation"] = explanation_future
+
+    # Le message attend la fin de son traitement
+    pending_deliveries.append(delivery)
+
+    if delivery["analysis"] is None:
+        complete_deliveries()
+    else:
+        delivery["analysis"].add_done_callback(on_job_done)
+        delivery["explanation"].add_done_callback(on_job_done)
+
+
+def main():
+    """
+    Point d’entrée principal du service combiné.
+
+    Cette fonction
+    vérifie la présence de Stockfish
+    initialise le moteur
+    recharge le cache des explications
+    se connecte à RabbitMQ
+    s’abonne aux événements
+    démarre l’écoute
+    """
+
+    global connection, channel
+
+    print("Analysis + explanation service démarré")
+
+    # Vérification de la présence de Stockfish
+    if not os.path.exists(analysis_service.STOCKFISH_PATH):
+        raise FileNotFoundError(
+            f"Stockfish introuvable : {analysis_service.STOCKFISH_PATH}"
+        )
+
+    # Lancement du moteur Stockfish
+    # Il est confié au service d’analyse qui l’utilise pour ses calculs
+    engine = chess.engine.SimpleEngine.popen_uci(
+        analysis_service.STOCKFISH_PATH
+    )
+    analysis_service.engine = engine
+
+    # Réglage des options de Stockfish, comme dans le service d’analyse
+    analysis_service.configure_engine(engine)
+
+    # Chargement du cache des explications
+    # et sauvegarde automatique à l’arrêt
+    explanation_service.load_explanation_cache()
+    atexit.register(explanation_service.save_explanation_cache)
+
+    # Connexion au serveur RabbitMQ
+    connection = broker.get_connection()
+
+    # Création du canal RabbitMQ
+    channel = broker.get_channel()
+
+    # Activation des confirmations de publication
+    channel.confirm_delivery()
+
+    # Déclaration de l’exchange commun
+    channel.exchange_declare(
+        exchange=EXCHANGE_NAME,
+        exchange_type="fanout",
+        durable=True
+    )
+
+    # Création d’une queue temporaire exclusive
+    queue = channel.queue_declare(
+        queue="",
+        exclusive=True
+    ).method.queue
+
+    # Liaison de la queue à l’exchange
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=queue
+    )
+
+    # Limitation du nombre de messages en transit sur ce canal
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
+    # Abonnement aux messages RabbitMQ
+    # Les messages sont acquittés manuellement
+    channel.basic_consume(
+        queue=queue,
+        on_message_callback=on_message,
+        auto_ack=False
+    )
+
+    print("Analysis + explanation prêt, en attente des coups")
+
+    # Démarrage de la boucle d’écoute
+    try:
+        channel.start_consuming()
+    finally:
+        # Abandon des calculs qui n’ont pas encore commencé
+        analysis_service.executor.shutdown(wait=False, cancel_futures=True)
+        explanation_service.executor.shutdown(
+            wait=False,
+            cancel_futures=True
+        )
+        engine.quit()
+
+
+# Point d’entrée du script
+if __name__ == "__main__":
+    main()
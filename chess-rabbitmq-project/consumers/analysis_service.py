@@ -21,8 +21,24 @@ sans interférer avec la partie.
 # Bibliothèque pour communiquer avec RabbitMQ
 import pika
 
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
+
 # Bibliothèque pour manipuler le format JSON
-import json
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+# Les deux exposent loads et dumps, acceptés tels quels par pika
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
+
+# Bibliothèque psutil, lecture de la mémoire disponible
+# Sans elle, la table de hachage de Stockfish garde une taille fixe
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 # Bibliothèque python-chess pour gérer le plateau et les coups
 import chess
@@ -30,16 +46,48 @@ import chess
 # Interface avec le moteur Stockfish
 import chess.engine
 
+# Cache des résultats de fonctions
+from functools import lru_cache
+
 # Accès au système de fichiers
 import os
 
+# Dictionnaire ordonné utilisé comme cache LRU
+# File des messages en cours de traitement, dans l’ordre de réception
+from collections import OrderedDict, deque
+
+# Thread dédié aux calculs de Stockfish
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
 
-# Adresse du serveur RabbitMQ
-RABBITMQ_HOST = "localhost"
 
 # Exchange commun utilisé par tous les services
 EXCHANGE_NAME = "chess.events"
 
+# Types d’événements traités par ce service
+# Les autres messages sont acquittés sans décoder leur corps
+HANDLED_EVENTS = frozenset({
+    "game_started",
+    "move_validated",
+    "game_ended"
+})
+
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    "analysis": pika.BasicProperties(headers={"event_type": "analysis"})
+}
+
 
 # Chemin vers l’exécutable Stockfish
 # Le chemin doit être exact pour que le moteur démarre
@@ -49,16 +97,109 @@ STOCKFISH_PATH = (
 )
 
 
+# Profondeur de recherche demandée à Stockfish pour chaque position
+ANALYSIS_DEPTH = 14
+
+# Limite de recherche transmise à Stockfish
+# Le même objet est réutilisé pour chaque analyse
+ANALYSIS_LIMIT = chess.engine.Limit(depth=ANALYSIS_DEPTH)
+
+# Ressources accordées au Stockfish de l’analyse
+# Le Stockfish de l’IA tourne en même temps sur la même machine
+# il réfléchit aussi pendant le tour du joueur humain (ponder)
+# Par défaut, chaque moteur reçoit donc la moitié des ressources
+# que la machine peut consacrer aux deux moteurs
+# ANALYSIS_ENGINE_THREADS et ANALYSIS_ENGINE_HASH_MB changent ce partage
+
+# Taille de la table de hachage interne de Stockfish en Mo
+# Elle persiste d’un coup à l’autre tant que le moteur reste lancé
+# La valeur par défaut de Stockfish (16 Mo) se remplit trop vite
+# et oblige à recalculer les positions déjà vues
+# Un huitième de la mémoire disponible, au plus 2 Go, si psutil est installé
+# sinon 256 Mo
+if psutil is not None:
+    DEFAULT_ENGINE_HASH_MB = max(
+        16,
+        min(2048, psutil.virtual_memory().available // (8 * 1024 * 1024))
+    )
+else:
+    DEFAULT_ENGINE_HASH_MB = 256
+
+ENGINE_HASH_MB = int(
+    os.environ.get("ANALYSIS_ENGINE_HASH_MB", DEFAULT_ENGINE_HASH_MB)
+)
+
+# Nombre de threads de recherche de Stockfish
+# Un cœur est laissé à RabbitMQ et aux autres services
+# les autres sont partagés entre les deux moteurs
+ENGINE_THREADS = int(
+    os.environ.get(
+        "ANALYSIS_ENGINE_THREADS",
+        max(1, ((os.cpu_count() or 2) - 1) // 2)
+    )
+)
+
+# Nombre maximal de positions conservées dans la table de transposition
+TT_MAX_ENTRIES = 100_000
+
+
+# Nombre maximal de messages non acquittés confiés à ce consommateur
+# Voir la QoS de canal RabbitMQ (basic_qos)
+# Sans limite, RabbitMQ pousse tous les messages en attente vers le client
+# pendant que Stockfish calcule, ce qui fait grossir la mémoire sans borne
+# Une valeur autour de 100 conserve l’essentiel du débit
+# tout en bornant les messages en transit
+PREFETCH_COUNT = 100
+
+# Nombre de messages traités avant un acquittement groupé
+# Un seul basic_ack(multiple=True) confirme tout le lot
+# ce qui réduit le nombre d’échanges avec RabbitMQ
+# PREFETCH_COUNT doit rester supérieur ou égal à cette valeur
+# sinon RabbitMQ cesse de livrer avant que le lot soit complet
+MESSAGES_PER_ACK = 16
+
+
 # Plateau local utilisé uniquement pour l’analyse
 # Il est reconstruit à partir des coups validés
 board = chess.Board()
 
-# Canal RabbitMQ global
+# Connexion et canal RabbitMQ globaux
+connection = None
 channel = None
 
 # Instance du moteur Stockfish
 engine = None
 
+# Thread unique exécutant les analyses Stockfish
+# Le moteur ne traite qu’une position à la fois
+# La boucle RabbitMQ reste libre pendant le calcul (heartbeats)
+executor = ThreadPoolExecutor(max_workers=1)
+
+# Identifiant de la partie en cours
+# Il change à chaque nouvelle partie pour que Stockfish reçoive ucinewgame
+game_id = 0
+
+# Messages reçus dont le traitement n’est pas terminé
+# Chaque élément contient (numéro de livraison, type d’événement, future)
+# La future vaut None pour les événements sans analyse
+pending_deliveries = deque()
+
+# Dernière analyse confiée au thread d’analyse
+# Elle est annulée si un coup plus récent arrive avant son démarrage
+latest_analysis = None
+
+# Table de transposition des positions déjà analysées
+# Clé : clé de transposition python-chess de la position
+# Valeur : (score, meilleur coup, texte, profondeur)
+# Les positions les moins récemment utilisées sont évincées en premier
+TT = OrderedDict()
+
+# Dernier numéro de livraison traité mais pas encore acquitté
+pending_delivery_tag = None
+
+# Nombre de messages traités depuis le dernier acquittement
+unacked_count = 0
+
 
 def publish(event_type, payload):
     """
@@ -74,37 +215,111 @@ def publish(event_type, payload):
         "payload": payload
     }
 
-    # Envoi du message sur l’exchange commun
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key="",
-        body=json.dumps(message)
-    )
+    body = json_codec.dumps(message)
 
-
-def analyse_position():
+    # Envoi du message sur l’exchange commun
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=PUBLISH_PROPERTIES[event_type]
+            )
+            return
+        except pika.exceptions.NackError:
+            print("Analyse refusée par RabbitMQ, nouvelle tentative")
+
+    print("Analyse non publiée :", event_type)
+
+
+def analyse_position(position, game):
     """
-    Analyse la position actuelle du plateau local.
+    Analyse une position de la partie.
+
+    position est une copie du plateau local avec ses coups.
+    game identifie la partie à laquelle appartient la position.
+    Cette fonction s’exécute dans le thread d’analyse.
 
     Cette fonction
+    évalue directement les positions de fin de partie
+    consulte la table de transposition
     demande une évaluation à Stockfish
     interprète le score
     calcule le meilleur coup
-    diffuse les résultats
+    retourne les données de l’analyse à diffuser
     """
 
-    # Analyse de la position avec une limite de temps
-    info = engine.analyse(
-        board,
-        chess.engine.Limit(time=0.5)
-    )
+    # Partie terminée sur l’échiquier
+    # Le résultat est connu, Stockfish n’a rien à chercher
+    outcome = position.outcome()
+    if outcome is not None:
+        if outcome.winner is None:
+            value, text = 0.0, "Partie nulle"
+        elif outcome.winner == chess.WHITE:
+            value, text = 100.0, "Mat BLANC"
+        else:
+            value, text = -100.0, "Mat NOIR"
+
+        return {
+            "score": value,
+            "best_move": "—",
+            "text": text
+        }
+
+    # Clé de la position courante
+    # Deux ordres de coups menant à la même position partagent la clé
+    key = position._transposition_key()
+
+    # Position déjà analysée à une profondeur suffisante
+    # Le résultat mémorisé est repris sans appeler Stockfish
+    cached = TT.get(key)
+    if cached is not None and cached[3] >= ANALYSIS_DEPTH:
+        TT.move_to_end(key)
+        value, best, text, _ = cached
+        return {
+            "score": value,
+            "best_move": best,
+            "text": text
+        }
+
+    # Analyse unique de la position
+    # La variante principale fournit aussi le meilleur coup
+    # ce qui évite une seconde recherche sur la même position
+    # Les informations sont lues au fil de la recherche
+    # La position est transmise sous la forme "startpos moves ..."
+    # et ucinewgame n’est envoyé que lorsque la partie change
+    with engine.analysis(
+        position,
+        ANALYSIS_LIMIT,
+        info=chess.engine.INFO_SCORE | chess.engine.INFO_PV,
+        game=game
+    ) as analysis:
+        for line in analysis:
+            score = line.get("score")
+
+            # Arrêt dès que la profondeur est atteinte
+            # ou qu’un mat est trouvé, inutile de chercher plus loin
+            if line.get("depth", 0) >= ANALYSIS_DEPTH or (
+                score is not None and score.is_mate()
+            ):
+                break
+
+        # Arrêt explicite de la recherche en cours
+        analysis.stop()
+
+        # Informations cumulées de la recherche
+        info = analysis.info
 
     # Récupération du score retourné par Stockfish
     score = info["score"]
 
     # Cas particulier où un mat est détecté
     if score.is_mate():
-        mate = score.mate()
+        # Nombre de coups avant le mat, du point de vue des BLANCS
+        mate = score.white().mate()
 
         if mate > 0:
             value = 100.0
@@ -118,22 +333,136 @@ def analyse_position():
         value = score.white().score() / 100.0
         text = f"{value:+.2f}"
 
-    # Calcul du meilleur coup recommandé par Stockfish
-    best = engine.play(
-        board,
-        chess.engine.Limit(time=0.3)
-    ).move.uci()
+    # Meilleur coup recommandé par Stockfish
+    # Premier coup de la variante principale
+    # La variante est vide lorsque la partie est terminée
+    pv = info.get("pv")
+    best = pv[0].uci() if pv else "—"
 
-    # Diffusion de l’analyse
-    publish(
-        "analysis",
-        {
-            "score": value,
-            "best_move": best,
-            "text": text
-        }
+    # Profondeur réellement atteinte par la recherche
+    # Un mat trouvé est définitif, quelle que soit la profondeur
+    if score.is_mate():
+        depth = ANALYSIS_DEPTH
+    else:
+        depth = info.get("depth", 0)
+
+    # Mémorisation du résultat dans la table de transposition
+    TT[key] = (value, best, text, depth)
+    TT.move_to_end(key)
+
+    # Éviction de la position la plus ancienne si la table est pleine
+    if len(TT) > TT_MAX_ENTRIES:
+        TT.popitem(last=False)
+
+    # Données de l’analyse
+    return {
+        "score": value,
+        "best_move": best,
+        "text": text
+    }
+
+
+def configure_engine(engine):
+    """
+    Règle les options de Stockfish pour l’analyse.
+
+    engine est le moteur Stockfish lancé par le service.
+
+    Les options absentes de la version installée sont ignorées.
+    """
+
+    # Configuration de la table de hachage et des threads de Stockfish
+    # La table interne est conservée entre les analyses successives
+    engine.configure({
+        "Hash": ENGINE_HASH_MB,
+        "Threads": ENGINE_THREADS
+    })
+
+    # Mode analyse, uniquement si la version de Stockfish le propose
+    if "UCI_AnalyseMode" in engine.options:
+        engine.configure({"UCI_AnalyseMode": True})
+
+    # Évaluation par réseau de neurones (NNUE)
+    # Les versions récentes l’utilisent toujours et n’ont plus cette option
+    if "Use NNUE" in engine.options:
+        engine.configure({"Use NNUE": True})
+
+
+def flush_acks(ch):
+    """
+    Acquitte d’un seul coup tous les messages déjà traités.
+
+    ch est le canal RabbitMQ sur lequel les messages ont été reçus.
+    """
+
+    global pending_delivery_tag, unacked_count
+
+    # Rien à acquitter
+    if pending_delivery_tag is None:
+        return
+
+    # Acquittement groupé jusqu’au dernier message traité inclus
+    ch.basic_ack(
+        delivery_tag=pending_delivery_tag,
+        multiple=True
     )
 
+    pending_delivery_tag = None
+    unacked_count = 0
+
+
+def complete_deliveries():
+    """
+    Termine le traitement des messages dans l’ordre de réception.
+
+    Cette fonction s’exécute dans le thread de RabbitMQ.
+    Elle diffuse les analyses terminées
+    puis ajoute les messages au lot à acquitter.
+    """
+
+    global pending_delivery_tag, unacked_count
+
+    while pending_deliveries:
+        delivery_tag, event_type, future = pending_deliveries[0]
+
+        # Analyse encore en cours, les messages suivants attendent
+        if future is not None and not future.done():
+            break
+
+        pending_deliveries.popleft()
+
+        # Diffusion de l’analyse
+        # Une analyse annulée par un coup plus récent n’est pas diffusée
+        # Une analyse en échec, par exemple après une erreur de Stockfish,
+        # est signalée puis le message est acquitté comme les autres
+        if future is not None and not future.cancelled():
+            try:
+                result = future.result()
+            except Exception as error:
+                print("Analyse impossible :", error)
+            else:
+                publish("analysis", result)
+
+        # Le message est traité, il rejoint le lot à acquitter
+        pending_delivery_tag = delivery_tag
+        unacked_count += 1
+
+        # Acquittement du lot lorsqu’il est complet
+        # ou à la fin de la partie pour ne rien laisser en attente
+        if unacked_count >= MESSAGES_PER_ACK or event_type == "game_ended":
+            flush_acks(channel)
+
+
+def on_analysis_done(future):
+    """
+    Appelée par le thread d’analyse quand une position est analysée.
+
+    pika n’étant pas thread-safe,
+    la diffusion est confiée au thread de RabbitMQ.
+    """
+
+    connection.add_callback_threadsafe(complete_deliveries)
+
 
 def on_message(ch, method, properties, body):
     """
@@ -142,33 +471,63 @@ def on_message(ch, method, properties, body):
     Cette fonction permet de
     reconstruire la partie localement
     déclencher l’analyse après chaque coup validé
+    acquitter les messages par lots
     """
 
-    # Décodage du message JSON
-    event = json.loads(body)
+    global game_id, latest_analysis
+
+    # Analyse éventuellement lancée pour ce message
+    future = None
 
-    # Lecture du type d’événement
-    event_type = event.get("event_type")
+    # Événement sans intérêt pour l’analyse
+    # Il rejoint tout de même le lot à acquitter, dans l’ordre
+    if broker.is_ignored_event(properties, HANDLED_EVENTS):
+        pending_deliveries.append((method.delivery_tag, None, None))
+        complete_deliveries()
+        return
 
-    # Lecture des données associées
-    payload = event.get("payload", {})
+    # Décodage du message
+    # Lecture du type d’événement et des données associées
+    event_type, payload = broker.decode_event(properties, body)
 
     # Début d’une nouvelle partie
     if event_type == "game_started":
         board.reset()
+        game_id += 1
 
     # Coup validé par le service de validation
     elif event_type == "move_validated":
-        move = chess.Move.from_uci(payload["uci"])
+        move = parse_uci(payload["uci"])
         board.push(move)
 
-        # Analyse immédiate après le coup
-        analyse_position()
+        # La position précédente est devenue obsolète
+        # Son analyse est abandonnée si Stockfish ne l’a pas commencée
+        # Seule la position la plus récente est analysée pendant une rafale
+        if latest_analysis is not None:
+            latest_analysis.cancel()
+
+        # Analyse lancée dans le thread dédié
+        # La copie évite de partager le plateau entre les threads
+        # Elle garde la liste des coups, envoyée telle quelle à Stockfish
+        future = executor.submit(
+            analyse_position,
+            board.copy(),
+            game_id
+        )
+        latest_analysis = future
 
     # Fin de partie
     elif event_type == "game_ended":
         print("Analyse terminée")
 
+    # Le message attend la fin de son traitement
+    pending_deliveries.append((method.delivery_tag, event_type, future))
+
+    if future is None:
+        complete_deliveries()
+    else:
+        future.add_done_callback(on_analysis_done)
+
 
 def main():
     """
@@ -182,7 +541,7 @@ def main():
     démarre l’écoute
     """
 
-    global channel, engine
+    global connection, channel, engine
 
     print("Analysis service démarré")
 
@@ -195,13 +554,18 @@ def main():
     # Lancement du moteur Stockfish
     engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
 
+    # Réglage des options de Stockfish
+    configure_engine(engine)
+
     # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    connection = broker.get_connection()
 
     # Création du canal RabbitMQ
-    channel = connection.channel()
+    channel = broker.get_channel()
+
+    # Activation des confirmations de publication
+    # RabbitMQ confirme chaque message publié sur ce canal
+    channel.confirm_delivery()
 
     # Déclaration de l’exchange commun
     channel.exchange_declare(
@@ -222,17 +586,32 @@ def main():
         queue=queue
     )
 
+    # Limitation du nombre de messages en transit sur ce canal
+    # La limite s’applique aux messages en attente d’acquittement
+    channel.basic_qos(
+        prefetch_count=PREFETCH_COUNT,
+        global_qos=False
+    )
+
     # Abonnement aux messages RabbitMQ
     channel.basic_consume(
         queue=queue,
         on_message_callback=on_message,
-        auto_ack=True
+        auto_ack=False
     )
 
     print("Analysis prête, en attente des coups")
 
     # Démarrage de la boucle d’écoute
-    channel.start_consuming()
+    try:
+        channel.start_consuming()
+    finally:
+        # Abandon des analyses qui n’ont pas encore commencé
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        # Acquittement des messages restants avant la fermeture
+        if channel.is_open:
+            flush_acks(channel)
 
 
 # Point d’entrée du script
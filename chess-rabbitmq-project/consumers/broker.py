@@ -0,0 +1,206 @@
+r"""
+broker.py
+
+Ce fichier regroupe la connexion à RabbitMQ des services consommateurs.
+
+Il permet de
+partager une seule connexion TCP entre les services lancés dans un même processus
+ouvrir un canal par service sur cette connexion
+régler une seule fois les paramètres de connexion
+décoder les messages reçus de la même façon dans tous les services
+
+Avec une seule connexion, RabbitMQ gère moins de processus
+et un seul échange de heartbeats sert à tous les canaux.
+"""
+
+# Bibliothèque pour communiquer avec RabbitMQ
+import pika
+
+# Bibliothèque pour manipuler le format JSON
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
+
+# Bibliothèque MessagePack, format binaire plus compact que JSON
+# Elle n’est nécessaire que si un producteur publie dans ce format
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Bibliothèque zstandard, compression des messages volumineux
+# Elle n’est nécessaire que si un service publie des messages compressés
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bibliothèque msgspec, décodage JSON typé écrit en C
+# Si elle est installée, l’enveloppe des événements est décodée
+# directement dans une structure, sans dictionnaire intermédiaire
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# Adresse du serveur RabbitMQ
+RABBITMQ_HOST = "localhost"
+
+# Paramètres de la connexion
+# heartbeat : intervalle des heartbeats en secondes
+# blocked_connection_timeout : abandon si RabbitMQ bloque la connexion
+# (mémoire ou disque saturés) plus longtemps que ce délai en secondes
+# tcp_options : détection des connexions TCP mortes par keepalive
+# les options inconnues du système sont ignorées par pika
+CONNECTION_PARAMETERS = pika.ConnectionParameters(
+    host=RABBITMQ_HOST,
+    heartbeat=60,
+    blocked_connection_timeout=30,
+    tcp_options={"TCP_KEEPIDLE": 60}
+)
+
+# Type de contenu des messages encodés en MessagePack
+# Les messages sans ce type sont décodés en JSON
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# Encodage des messages compressés avec zstd
+# Les messages sans cet encodage ne sont pas compressés
+ZSTD_CONTENT_ENCODING = "zstd"
+
+
+# Connexion partagée
+# Elle est ouverte au premier appel de get_connection
+_connection = None
+
+
+def get_connection():
+    """
+    Retourne la connexion partagée à RabbitMQ.
+
+    La connexion est ouverte au premier appel,
+    ou de nouveau si la précédente a été fermée.
+    """
+
+    global _connection
+
+    if _connection is None or _connection.is_closed:
+        _connection = pika.BlockingConnection(CONNECTION_PARAMETERS)
+
+    return _connection
+
+
+def get_channel():
+    """
+    Ouvre un nouveau canal sur la connexion partagée.
+
+    Chaque service utilise son propre canal.
+    """
+
+    return get_connection().channel()
+
+
+def is_ignored_event(properties, handled_events):
+    """
+    Indique si un message peut être ignoré sans décoder son corps.
+
+    handled_events contient les types d’événements traités par le service.
+
+    Le type d’événement est lu dans les en-têtes AMQP du message.
+    Un message sans cet en-tête est toujours décodé.
+    """
+
+    headers = properties.headers
+
+    if not headers or "event_type" not in headers:
+        return False
+
+    return headers["event_type"] not in handled_events
+
+
+# Enveloppe commune à tous les événements, décodée par msgspec
+# Les champs inconnus, comme l’horodatage des producteurs, sont ignorés
+if msgspec is not None:
+
+    class Event(msgspec.Struct):
+        event_type: str = ""
+        payload: dict = {}
+
+    # Décodeur JSON préparé une seule fois
+    event_decoder = msgspec.json.Decoder(Event)
+
+
+def decompress_body(properties, body):
+    """
+    Décompresse le corps d’un message compressé avec zstd.
+
+    Le corps est retourné tel quel s’il n’est pas compressé.
+    Retourne None si zstandard n’est pas installé.
+    """
+
+    if properties.content_encoding != ZSTD_CONTENT_ENCODING:
+        return body
+
+    # Message ignoré si zstandard n’est pas installé
+    if zstandard is None:
+        print("Message zstd ignoré : zstandard absent")
+        return None
+
+    return zstandard.decompress(body)
+
+
+def decode_body(properties, body):
+    """
+    Décode le corps complet d’un message RabbitMQ.
+
+    Retourne l’événement sous forme de dictionnaire,
+    vide si le message ne peut pas être décodé.
+
+    Le format est choisi d’après le content_type du message.
+    JSON reste le format par défaut.
+    Un corps compressé avec zstd est d’abord décompressé.
+    """
+
+    body = decompress_body(properties, body)
+
+    if body is None:
+        return {}
+
+    if properties.content_type == MSGPACK_CONTENT_TYPE:
+        # Message ignoré si msgpack n’est pas installé
+        if msgpack is None:
+            print("Message MessagePack ignoré : msgpack absent")
+            return {}
+
+        return msgpack.unpackb(body, raw=False)
+
+    return json_codec.loads(body)
+
+
+def decode_event(properties, body):
+    """
+    Décode le type et les données d’un événement RabbitMQ.
+
+    Retourne le type d’événement et les données associées.
+
+    Avec msgspec, l’enveloppe JSON est lue directement
+    sans dictionnaire intermédiaire.
+    Les autres cas passent par decode_body.
+    """
+
+    if msgspec is not None and properties.content_type != MSGPACK_CONTENT_TYPE:
+        body = decompress_body(properties, body)
+
+        if body is None:
+            return None, {}
+
+        # Lecture directe des champs, sans dictionnaire intermédiaire
+        event = event_decoder.decode(body)
+        return event.event_type, event.payload
+
+    event = decode_body(properties, body)
+
+    return event.get("event_type"), event.get("payload", {})
@@ -20,30 +20,114 @@ Il produit uniquement du texte explicatif.
 # Bibliothèque pour communiquer avec RabbitMQ
 import pika
 
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
+
 # Bibliothèque pour manipuler le format JSON
-import json
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+# Les deux exposent loads et dumps, acceptés tels quels par pika
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
+
+# Bibliothèque zstandard, compression des longues explications publiées
+# Sans elle, les explications sont envoyées sans compression
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Bibliothèque python-chess pour reconstruire le plateau
 import chess
 
+# Cache des résultats de fonctions
+from functools import lru_cache
+
 # Accès aux variables d’environnement
 import os
 
+# Sauvegarde du cache à l’arrêt du service
+import atexit
+
+# Verrou protégeant le cache partagé entre les threads
+import threading
+
+# File des explications en cours, dans l’ordre des coups
+# Dictionnaire ordonné utilisé comme cache LRU
+from collections import deque, OrderedDict
+
+# Pool de threads pour les appels à l’API
+from concurrent.futures import ThreadPoolExecutor
+
 # Client OpenAI et gestion des erreurs
 from openai import OpenAI, RateLimitError, OpenAIError
 
 
-# Adresse du serveur RabbitMQ
-RABBITMQ_HOST = "localhost"
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
+
 
 # Exchange commun à tous les services
 EXCHANGE_NAME = "chess.events"
 
+# Types d’événements traités par ce service
+# Les autres messages sont acquittés sans décoder leur corps
+HANDLED_EVENTS = frozenset({
+    "game_started",
+    "analysis",
+    "move_validated"
+})
+
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    "move_explained": pika.BasicProperties(headers={"event_type": "move_explained"})
+}
+
+# Mêmes propriétés pour les messages compressés avec zstd
+COMPRESSED_PUBLISH_PROPERTIES = {
+    "move_explained": pika.BasicProperties(
+        content_encoding=broker.ZSTD_CONTENT_ENCODING,
+        headers={"event_type": "move_explained"}
+    )
+}
+
+# Taille en octets à partir de laquelle un message publié est compressé
+# Les petits messages sont envoyés tels quels
+# leur compression coûterait plus qu’elle ne ferait gagner
+COMPRESSION_MIN_SIZE = 1024
+
 
 # Modèle d’IA utilisé pour générer le texte
 MODEL = "gpt-4o-mini"
 
 
+# Nombre maximal d’appels à l’API effectués en parallèle
+# Plusieurs coups peuvent être expliqués en même temps
+# au lieu d’attendre chaque réponse HTTP l’une après l’autre
+LLM_WORKERS = 8
+
+# Nombre maximal de messages non acquittés confiés à ce consommateur
+# Il couvre les appels en cours plus une petite réserve
+PREFETCH_COUNT = 16
+
+
+# Nombre maximal d’explications conservées en cache
+EXPLANATION_CACHE_SIZE = 4096
+
+# Fichier de sauvegarde du cache entre deux lancements du service
+EXPLANATION_CACHE_PATH = "explanations.json"
+
+
 # Récupération de la clé OpenAI depuis les variables d’environnement
 api_key = os.getenv("OPENAI_API_KEY")
 
@@ -69,9 +153,51 @@ last_analysis = {
     "best_move": "—"
 }
 
-# Canal RabbitMQ global
+# Connexion et canal RabbitMQ globaux
+connection = None
 channel = None
 
+# Pool de threads exécutant les appels à l’API
+executor = ThreadPoolExecutor(max_workers=LLM_WORKERS)
+
+# Explications en cours de génération
+# Chaque élément contient (numéro de livraison, coup, future)
+# L’ordre des coups est conservé pour la diffusion
+pending_explanations = deque()
+
+# Cache des explications déjà générées
+# Clé : (coup, score arrondi, meilleur coup, clé de position)
+# La clé de position est la clé de transposition de python-chess
+# calculée directement à partir des bitboards, sans construire de FEN
+# Valeur : texte de l’explication
+# Une position rejouée ne provoque pas de nouvel appel à l’API
+explanation_cache = OrderedDict()
+
+# Verrou du cache, utilisé par les threads du pool
+explanation_cache_lock = threading.Lock()
+
+# Compresseur zstd préparé une seule fois
+# Il n’est utilisé que depuis le thread de RabbitMQ
+zstd_compressor = zstandard.ZstdCompressor() if zstandard is not None else None
+
+
+def compress_body(body):
+    """
+    Compresse avec zstd le corps d’un message volumineux.
+
+    Retourne None si le corps doit être envoyé tel quel
+    message trop petit ou zstandard absent
+    """
+
+    if zstd_compressor is None or len(body) < COMPRESSION_MIN_SIZE:
+        return None
+
+    # orjson produit des octets, json produit une chaîne
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    return zstd_compressor.compress(body)
+
 
 def publish(event_type, payload):
     """
@@ -81,28 +207,124 @@ def publish(event_type, payload):
     payload contient les données associées.
     """
 
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key="",
-        body=json.dumps({
-            "event_type": event_type,
-            "payload": payload
-        })
-    )
+    body = json_codec.dumps({
+        "event_type": event_type,
+        "payload": payload
+    })
+    properties = PUBLISH_PROPERTIES[event_type]
+
+    # Les longues explications sont compressées
+    compressed = compress_body(body)
+
+    if compressed is not None:
+        body = compressed
+        properties = COMPRESSED_PUBLISH_PROPERTIES[event_type]
+
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=properties
+            )
+            return
+        except pika.exceptions.NackError:
+            print("Explication refusée par RabbitMQ, nouvelle tentative")
+
+    print("Explication non publiée :", event_type)
+
+
+def load_explanation_cache():
+    """
+    Recharge le cache des explications sauvegardé sur disque.
+
+    Le fichier est ignoré s’il n’existe pas encore.
+    Un fichier illisible est ignoré, le cache repart vide.
+    """
+
+    if not os.path.exists(EXPLANATION_CACHE_PATH):
+        return
+
+    with open(EXPLANATION_CACHE_PATH, "rb") as f:
+        data = f.read()
+
+    # Chaque entrée est [coup, score, meilleur coup, clé de position, texte]
+    # La clé de position est relue comme une liste, reconvertie en tuple
+    # Les erreurs de décodage d’orjson et de json héritent de ValueError
+    try:
+        entries = json_codec.loads(data)
+
+        for move, score, best_move, position_key, text in entries:
+            key = (move, score, best_move, tuple(position_key))
+            explanation_cache[key] = text
+    except (ValueError, TypeError):
+        print("Cache des explications illisible, ignoré")
+        explanation_cache.clear()
+
+
+def save_explanation_cache():
+    """
+    Sauvegarde le cache des explications sur disque.
+
+    Cette fonction est appelée automatiquement à l’arrêt du service.
+    Le fichier est écrit à côté puis mis en place en une seule opération,
+    un arrêt pendant l’écriture laisse l’ancien fichier intact.
+    """
+
+    with explanation_cache_lock:
+        entries = [
+            [*key, text] for key, text in explanation_cache.items()
+        ]
+
+    data = json_codec.dumps(entries)
+
+    # orjson produit des octets, json produit une chaîne
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    temp_path = EXPLANATION_CACHE_PATH + ".tmp"
+
+    with open(temp_path, "wb") as f:
+        f.write(data)
 
+    os.replace(temp_path, EXPLANATION_CACHE_PATH)
 
-def call_llm(move, score, best_move, fen):
+
+def call_llm(move, score, best_move, board):
     """
     Génère une explication pédagogique via l’IA.
 
     move est le coup joué.
     score est l’évaluation Stockfish.
     best_move est le coup recommandé.
-    fen représente la position actuelle.
+    board est le plateau dans la position actuelle.
+
+    La FEN n’est construite que si l’API est réellement appelée.
+    Une explication déjà générée pour la même situation
+    est reprise du cache sans appeler l’API.
     """
 
-    # Construction du prompt pédagogique
-    prompt = f"""
+    try:
+        # Recherche dans le cache
+        # Le score est arrondi pour regrouper les évaluations très proches
+        # La position est identifiée par sa clé de transposition
+        key = (move, round(score, 1), best_move, board._transposition_key())
+
+        with explanation_cache_lock:
+            cached = explanation_cache.get(key)
+            if cached is not None:
+                explanation_cache.move_to_end(key)
+                return cached
+
+        # Représentation FEN de la position actuelle
+        # Elle n’est utile que pour le prompt
+        fen = board.fen()
+
+        # Construction du prompt pédagogique
+        prompt = f"""
 Tu es un professeur d'échecs pédagogue.
 
 Position actuelle (FEN) : {fen}
@@ -116,7 +338,6 @@ l’idée stratégique du coup
 ce que le joueur aurait dû chercher
 """
 
-    try:
         # Appel à l’API OpenAI
         response = client.chat.completions.create(
             model=MODEL,
@@ -133,8 +354,21 @@ ce que le joueur aurait dû chercher
             temperature=0.4
         )
 
+        # Texte généré
+        text = response.choices[0].message.content.strip()
+
+        # Mémorisation dans le cache
+        # Les textes de secours ne sont jamais mis en cache
+        with explanation_cache_lock:
+            explanation_cache[key] = text
+            explanation_cache.move_to_end(key)
+
+            # Éviction de l’explication la plus ancienne si le cache est plein
+            if len(explanation_cache) > EXPLANATION_CACHE_SIZE:
+                explanation_cache.popitem(last=False)
+
         # Retour du texte généré
-        return response.choices[0].message.content.strip()
+        return text
 
     except RateLimitError:
         # Texte de secours en cas de dépassement de quota
@@ -163,6 +397,42 @@ ce que le joueur aurait dû chercher
         )
 
 
+def publish_ready_explanations():
+    """
+    Diffuse les explications terminées dans l’ordre des coups.
+
+    Cette fonction s’exécute dans le thread de RabbitMQ.
+    Une explication n’est diffusée que lorsque
+    toutes celles des coups précédents l’ont été.
+    """
+
+    while pending_explanations and pending_explanations[0][2].done():
+        delivery_tag, uci, future = pending_explanations.popleft()
+
+        # Diffusion de l’explication
+        publish(
+            "move_explained",
+            {
+                "uci": uci,
+                "text": future.result()
+            }
+        )
+
+        # Le coup est expliqué, le message peut être acquitté
+        channel.basic_ack(delivery_tag=delivery_tag)
+
+
+def on_explanation_done(future):
+    """
+    Appelée par le pool de threads quand une explication est prête.
+
+    pika n’étant pas thread-safe,
+    la diffusion est confiée au thread de RabbitMQ.
+    """
+
+    connection.add_callback_threadsafe(publish_ready_explanations)
+
+
 def on_message(ch, method, properties, body):
     """
     Traite les événements reçus depuis RabbitMQ.
@@ -170,19 +440,20 @@ def on_message(ch, method, properties, body):
     Cette fonction
     met à jour le plateau local
     mémorise la dernière analyse
-    génère l’explication après chaque coup validé
+    lance l’explication après chaque coup validé
+    acquitte les messages une fois traités
     """
 
     global last_analysis
 
-    # Décodage du message JSON
-    event = json.loads(body)
-
-    # Lecture du type d’événement
-    event_type = event.get("event_type")
+    # Événement sans intérêt pour l’explication
+    if broker.is_ignored_event(properties, HANDLED_EVENTS):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
 
-    # Lecture des données associées
-    payload = event.get("payload", {})
+    # Décodage du message
+    # Lecture du type d’événement et des données associées
+    event_type, payload = broker.decode_event(properties, body)
 
     # Début d’une nouvelle partie
     if event_type == "game_started":
@@ -195,25 +466,30 @@ def on_message(ch, method, properties, body):
 
     # Coup validé
     elif event_type == "move_validated":
-        move = chess.Move.from_uci(payload["uci"])
+        move = parse_uci(payload["uci"])
         board.push(move)
 
-        # Génération du texte explicatif
-        explanation = call_llm(
+        # Génération du texte explicatif dans le pool de threads
+        # Une copie du plateau est transmise
+        # car le plateau local continue d’évoluer
+        future = executor.submit(
+            call_llm,
             payload["uci"],
             last_analysis["score"],
             last_analysis["best_move"],
-            board.fen()
+            board.copy(stack=False)
         )
 
-        # Diffusion de l’explication
-        publish(
-            "move_explained",
-            {
-                "uci": payload["uci"],
-                "text": explanation
-            }
+        pending_explanations.append(
+            (method.delivery_tag, payload["uci"], future)
         )
+        future.add_done_callback(on_explanation_done)
+
+        # L’acquittement aura lieu après la diffusion de l’explication
+        return
+
+    # Les autres événements sont acquittés immédiatement
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
 def main():
@@ -221,20 +497,28 @@ def main():
     Point d’entrée principal du service d’explication.
 
     Cette fonction
+    recharge le cache des explications
     initialise RabbitMQ
     s’abonne aux événements
     démarre l’écoute
     """
 
-    global channel
+    global connection, channel
+
+    # Chargement du cache des explications
+    # et sauvegarde automatique à l’arrêt
+    load_explanation_cache()
+    atexit.register(save_explanation_cache)
 
     # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    connection = broker.get_connection()
 
     # Création du canal RabbitMQ
-    channel = connection.channel()
+    channel = broker.get_channel()
+
+    # Activation des confirmations de publication
+    # RabbitMQ confirme chaque message publié sur ce canal
+    channel.confirm_delivery()
 
     # Déclaration de l’exchange commun
     channel.exchange_declare(
@@ -255,17 +539,25 @@ def main():
         queue=queue
     )
 
+    # Limitation du nombre de messages en transit sur ce canal
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
     # Abonnement aux messages RabbitMQ
+    # Les messages sont acquittés manuellement
     channel.basic_consume(
         queue=queue,
         on_message_callback=on_message,
-        auto_ack=True
+        auto_ack=False
     )
 
     print("Explanation service prêt")
 
     # Démarrage de la boucle d’écoute
-    channel.start_consuming()
+    try:
+        channel.start_consuming()
+    finally:
+        # Abandon des appels qui n’ont pas encore commencé
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 # Point d’entrée du script
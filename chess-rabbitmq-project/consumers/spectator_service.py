@@ -16,15 +16,15 @@ Il ne valide pas.
 Il écoute uniquement les événements RabbitMQ.
 """
 
-# Bibliothèque pour communiquer avec RabbitMQ
-import pika
-
-# Bibliothèque pour manipuler le format JSON
-import json
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
 
 # Bibliothèque python-chess pour gérer le plateau
 import chess
 
+# Cache des résultats de fonctions
+from functools import lru_cache
+
 # Bibliothèque pour créer l’interface graphique
 import tkinter as tk
 
@@ -32,14 +32,17 @@ import tkinter as tk
 from tkinter import Text, Scrollbar
 
 # Bibliothèque pour afficher les images
-from PIL import Image, ImageTk
+from PIL import Image, ImageColor, ImageTk
 
 # Accès au système de fichiers
 import os
 
 
-# Adresse du serveur RabbitMQ
-RABBITMQ_HOST = "localhost"
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
+
 
 # Exchange commun utilisé par tous les services
 EXCHANGE_NAME = "chess.events"
@@ -53,13 +56,62 @@ PIECES_PATH = r"C:\Users\mario\OneDrive\Images\cburnett"
 # Taille d’une case du plateau en pixels
 SQUARE_SIZE = 64
 
+# Couleurs des cases claires et foncées
+LIGHT_COLOR = "#EEEED2"
+DARK_COLOR = "#769656"
+
+
+# Délai entre le premier changement du plateau et son dessin en millisecondes
+# Les coups reçus pendant ce délai sont dessinés en une seule fois
+REDRAW_INTERVAL_MS = 50
+
+# Intervalle de la boucle RabbitMQ par interrogation en millisecondes
+# Elle n’est utilisée que si Tk ne peut pas surveiller le socket (Windows)
+POLL_INTERVAL_MS = 100
+
+# Intervalle d’entretien de la connexion RabbitMQ en millisecondes
+# Les heartbeats doivent être traités même en l’absence de message
+MAINTENANCE_INTERVAL_MS = 1000
+
+# Nombre maximal de messages non acquittés confiés au spectateur
+# La mise à jour de l’interface est rapide, la limite peut être large
+# Elle borne tout de même la mémoire lors d’une rafale de coups
+PREFETCH_COUNT = 100
+
+
+# Coordonnées sur le canvas de l’image de chaque case
+# Indexées comme les cases de python-chess (a1 = 0, h8 = 63)
+# Les pièces sont décalées de 4 pixels pour être centrées dans la case
+SQUARE_COORDS = [
+    ((square & 7) * SQUARE_SIZE + 4, (7 - (square >> 3)) * SQUARE_SIZE + 4)
+    for square in chess.SQUARES
+]
+
 
 # Plateau local du spectateur
 # Il est synchronisé avec les coups validés
 board = chess.Board()
 
-# Dictionnaire contenant les images des pièces
-piece_images = {}
+# Images des pièces indexées par couleur puis par type de pièce
+# piece_images[0] contient les BLANCS, piece_images[1] les NOIRS
+# L’indice du type suit chess.PAWN (1) à chess.KING (6)
+piece_images = [[None] * 7, [None] * 7]
+
+# Image du plateau vide
+# Elle est calculée une seule fois au chargement
+board_bg = None
+
+# Identifiant sur le canvas de l’image de chaque case
+# Les 64 images sont créées une seule fois puis modifiées sur place
+square_items = []
+
+# Image actuellement affichée sur chaque case
+# La chaîne vide correspond à une case sans pièce
+shown_images = [""] * 64
+
+
+# Indique si le plateau a changé depuis le dernier dessin
+board_dirty = False
 
 
 # Dernière évaluation reçue
@@ -72,14 +124,54 @@ best_move = "—"
 current_explanation = ""
 
 
+def load_piece_image(filename, cache_dir):
+    """
+    Charge l’image d’une pièce à la taille affichée sur le plateau.
+
+    L’image préparée par tools/prebake_pieces.py est utilisée
+    si elle existe et a la bonne taille.
+    Sinon l’image d’origine est redimensionnée au chargement.
+    """
+
+    size = (SQUARE_SIZE - 8, SQUARE_SIZE - 8)
+    cached_path = os.path.join(cache_dir, filename)
+
+    if os.path.isfile(cached_path):
+        # Un fichier tronqué ou illisible est ignoré
+        try:
+            img = Image.open(cached_path)
+            img.load()
+        except OSError:
+            img = None
+
+        # Image déjà à la bonne taille
+        if img is not None and img.size == size:
+            return img
+
+    # Ouverture de l’image d’origine
+    img = Image.open(os.path.join(PIECES_PATH, filename)).convert("RGBA")
+
+    # Redimensionnement avec le même filtre que tools/prebake_pieces.py
+    # Le plateau est identique avec ou sans cache
+    return img.resize(size, Image.LANCZOS)
+
+
 def load_images():
     """
     Charge les images des pièces d’échecs en mémoire.
 
     Les images sont redimensionnées
-    puis stockées dans un dictionnaire.
+    puis rangées par couleur et par type de pièce.
+
+    Les images préparées par tools/prebake_pieces.py
+    sont chargées telles quelles depuis le cache,
+    les autres sont redimensionnées au chargement.
+
+    L’image du plateau vide est aussi préparée ici.
     """
 
+    global board_bg
+
     pieces = {
         "P": "wP.png",
         "R": "wR.png",
@@ -95,68 +187,112 @@ def load_images():
         "k": "bK.png",
     }
 
+    # Dossier des images déjà redimensionnées pour cette taille de case
+    cache_dir = os.path.join(PIECES_PATH, f"cache_{SQUARE_SIZE}")
+
     for symbol, filename in pieces.items():
-        path = os.path.join(PIECES_PATH, filename)
+        # Image à la taille des cases, depuis le cache si possible
+        img = load_piece_image(filename, cache_dir)
+
+        # Conversion en image compatible Tkinter
+        piece = chess.Piece.from_symbol(symbol)
+        piece_images[not piece.color][piece.piece_type] = (
+            ImageTk.PhotoImage(img)
+        )
+
+    # Plateau vide dessiné hors écran
+    # Image de 8 x 8 pixels, un pixel par case
+    # puis agrandie sans lissage : chaque pixel devient une case entière
+    # L’agrandissement est fait en C par Pillow, sans boucle Python
+    light = ImageColor.getrgb(LIGHT_COLOR)
+    dark = ImageColor.getrgb(DARK_COLOR)
+
+    squares = Image.new("RGB", (8, 8))
+    squares.putdata([
+        light if (x + y) % 2 else dark
+        for y in range(8)
+        for x in range(8)
+    ])
+
+    bg = squares.resize(
+        (8 * SQUARE_SIZE, 8 * SQUARE_SIZE),
+        Image.NEAREST
+    )
+
+    # Conversion en image compatible Tkinter
+    board_bg = ImageTk.PhotoImage(bg)
+
+
+def draw_squares():
+    """
+    Dessine les cases du plateau d’échecs.
+
+    Les cases ne changent jamais.
+    Le plateau vide préparé au chargement est affiché
+    en une seule image, au lieu de 64 rectangles.
 
-        # Ouverture de l’image
-        img = Image.open(path).convert("RGBA")
+    Une image vide est aussi créée sur chaque case.
+    Les pièces y seront affichées sans recréer d’élément.
+    """
 
-        # Redimensionnement de l’image
-        img = img.resize((SQUARE_SIZE - 8, SQUARE_SIZE - 8))
+    canvas.create_image(
+        0,
+        0,
+        anchor="nw",
+        image=board_bg,
+        tags="bg"
+    )
 
-        # Conversion en image compatible Tkinter
-        piece_images[symbol] = ImageTk.PhotoImage(img)
+    for x, y in SQUARE_COORDS:
+        square_items.append(
+            canvas.create_image(
+                x,
+                y,
+                anchor="nw",
+                image="",
+                tags="piece"
+            )
+        )
 
 
 def draw_board():
     """
-    Dessine le plateau d’échecs et les pièces.
+    Dessine les pièces sur le plateau d’échecs.
 
     Cette fonction est appelée
     après chaque mise à jour de l’état du jeu.
-    """
-
-    canvas.delete("all")
-
-    # Dessin des cases du plateau
-    for row in range(8):
-        for col in range(8):
-            color = "#EEEED2" if (row + col) % 2 == 0 else "#769656"
 
-            x1 = col * SQUARE_SIZE
-            y1 = (7 - row) * SQUARE_SIZE
-            x2 = x1 + SQUARE_SIZE
-            y2 = y1 + SQUARE_SIZE
+    Seules les cases dont le contenu a changé sont modifiées.
+    Les images des cases existent déjà, seule la pièce affichée change.
+    """
 
-            canvas.create_rectangle(
-                x1,
-                y1,
-                x2,
-                y2,
-                fill=color,
-                outline=color
-            )
+    # Pièces présentes sur le plateau
+    # Seules les cases occupées sont renvoyées (32 au plus)
+    pieces = board.piece_map()
 
-    # Dessin des pièces
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
+    # Recherches locales, plus rapides dans la boucle
+    # que les attributs et variables globales relus à chaque case
+    itemconfig = canvas.itemconfig
+    get_piece = pieces.get
+    images = piece_images
+    shown = shown_images
+    items = square_items
 
-        if piece:
-            col = chess.square_file(square)
-            row = chess.square_rank(square)
+    for square in range(64):
+        piece = get_piece(square)
 
-            x = col * SQUARE_SIZE + 4
-            y = (7 - row) * SQUARE_SIZE + 4
+        # Image correspondant à la pièce, sans passer par son symbole
+        if piece is None:
+            image = ""
+        else:
+            image = images[not piece.color][piece.piece_type]
 
-            canvas.create_image(
-                x,
-                y,
-                anchor="nw",
-                image=piece_images[piece.symbol()]
-            )
+        # Case inchangée depuis le dernier dessin
+        if shown[square] is image:
+            continue
 
-    # Mise à jour du panneau d’informations
-    update_side_panel()
+        itemconfig(items[square], image=image)
+        shown[square] = image
 
 
 def update_side_panel():
@@ -181,43 +317,111 @@ def update_side_panel():
     move_label.config(text=f"Meilleur coup : {best_move}")
 
 
-def on_message(ch, method, properties, body):
+def mark_board_dirty():
     """
-    Traite les événements reçus depuis RabbitMQ.
+    Demande un nouveau dessin du plateau.
 
-    Cette fonction met à jour
-    le plateau
-    l’évaluation
-    l’explication pédagogique
+    Le dessin est programmé une seule fois, au premier changement.
+    Les changements suivants, avant ce dessin, sont dessinés avec lui.
+    """
+
+    global board_dirty
+
+    if not board_dirty:
+        board_dirty = True
+        root.after(REDRAW_INTERVAL_MS, refresh_board)
+
+
+def handle_game_started(payload):
+    """
+    Prépare l’affichage d’une nouvelle partie.
+    """
+
+    board.reset()
+    explanation_box.delete("1.0", tk.END)
+
+    # Les cases modifiées par la partie précédente seront redessinées
+    mark_board_dirty()
+
+
+def handle_move_validated(payload):
+    """
+    Applique un coup validé sur le plateau local.
+    """
+
+    move = parse_uci(payload["uci"])
+    board.push(move)
+
+    # Le dessin est différé pour regrouper les coups rapprochés
+    mark_board_dirty()
+
+
+def handle_analysis(payload):
+    """
+    Affiche la dernière évaluation de Stockfish.
     """
 
     global current_score, best_move
 
-    event = json.loads(body)
-    event_type = event.get("event_type")
-    payload = event.get("payload", {})
+    current_score = payload.get("score", 0.0)
+    best_move = payload.get("best_move", "—")
+    update_side_panel()
+
+
+def handle_move_explained(payload):
+    """
+    Affiche l’explication pédagogique du dernier coup.
+    """
+
+    explanation_box.delete("1.0", tk.END)
+    explanation_box.insert(tk.END, payload.get("text", ""))
+
 
-    if event_type == "game_started":
-        board.reset()
-        explanation_box.delete("1.0", tk.END)
-        draw_board()
+def handle_game_ended(payload):
+    """
+    Signale la fin de la partie.
+    """
+
+    side_label.config(text="Partie terminée")
+
+
+def ignore_event(payload):
+    """
+    Événement sans effet sur l’affichage.
+    """
+
+
+# Fonction de traitement associée à chaque type d’événement
+# Une seule recherche dans le dictionnaire remplace la suite de comparaisons
+# Les événements absents sont acquittés sans décoder leur corps
+HANDLERS = {
+    "game_started": handle_game_started,
+    "move_validated": handle_move_validated,
+    "analysis": handle_analysis,
+    "move_explained": handle_move_explained,
+    "game_ended": handle_game_ended
+}
+
+
+def on_message(ch, method, properties, body):
+    """
+    Traite les événements reçus depuis RabbitMQ.
+
+    Cette fonction confie chaque événement
+    à la fonction de traitement de son type.
+    """
 
-    elif event_type == "move_validated":
-        move = chess.Move.from_uci(payload["uci"])
-        board.push(move)
-        draw_board()
+    # Événement sans effet sur l’affichage
+    if broker.is_ignored_event(properties, HANDLERS):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
 
-    elif event_type == "analysis":
-        current_score = payload.get("score", 0.0)
-        best_move = payload.get("best_move", "—")
-        update_side_panel()
+    event_type, payload = broker.decode_event(properties, body)
 
-    elif event_type == "move_explained":
-        explanation_box.delete("1.0", tk.END)
-        explanation_box.insert(tk.END, payload.get("text", ""))
+    HANDLERS.get(event_type, ignore_event)(payload)
 
-    elif event_type == "game_ended":
-        side_label.config(text="Partie terminée")
+    # Message traité, RabbitMQ peut livrer le suivant
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
 def rabbitmq_loop():
@@ -229,7 +433,73 @@ def rabbitmq_loop():
     """
 
     connection.process_data_events(time_limit=0.1)
-    root.after(100, rabbitmq_loop)
+    root.after(POLL_INTERVAL_MS, rabbitmq_loop)
+
+
+def on_socket_readable(fd, mask):
+    """
+    Appelée par Tk dès que des données arrivent sur le socket RabbitMQ.
+
+    Les messages sont traités immédiatement,
+    sans attendre un tour de boucle.
+    """
+
+    connection.process_data_events(time_limit=0)
+
+
+def maintain_connection():
+    """
+    Entretient la connexion RabbitMQ à intervalle lent.
+
+    Cette fonction traite les heartbeats et les temporisations de pika
+    lorsque aucun message n’arrive.
+    """
+
+    connection.process_data_events(time_limit=0)
+    root.after(MAINTENANCE_INTERVAL_MS, maintain_connection)
+
+
+def start_rabbitmq_loop():
+    """
+    Branche RabbitMQ sur la boucle Tkinter.
+
+    Lorsque c’est possible, Tk surveille directement le socket
+    et réveille le spectateur uniquement à l’arrivée d’un message.
+    Sinon, la boucle par interrogation régulière est utilisée.
+    """
+
+    # pika n’expose pas publiquement le socket de la connexion
+    transport = getattr(connection._impl, "_transport", None)
+    sock = getattr(transport, "_sock", None)
+
+    # createfilehandler n’existe pas sous Windows
+    if sock is not None and hasattr(root.tk, "createfilehandler"):
+        root.tk.createfilehandler(
+            sock.fileno(),
+            tk.READABLE,
+            on_socket_readable
+        )
+
+        # Traitement des messages déjà reçus pendant l’initialisation
+        maintain_connection()
+
+    else:
+        root.after(POLL_INTERVAL_MS, rabbitmq_loop)
+
+
+def refresh_board():
+    """
+    Redessine le plateau après un changement.
+
+    Cette fonction est programmée par mark_board_dirty.
+    Plusieurs coups reçus en rafale ne provoquent qu’un seul dessin.
+    Rien n’est programmé tant que le plateau ne change pas.
+    """
+
+    global board_dirty
+
+    board_dirty = False
+    draw_board()
 
 
 # Création de la fenêtre principale
@@ -296,15 +566,15 @@ scrollbar.config(command=explanation_box.yview)
 
 # Chargement des images et dessin initial
 load_images()
+draw_squares()
 draw_board()
+update_side_panel()
 
 
 # Connexion RabbitMQ
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(host=RABBITMQ_HOST)
-)
+connection = broker.get_connection()
 
-channel = connection.channel()
+channel = broker.get_channel()
 
 channel.exchange_declare(
     exchange=EXCHANGE_NAME,
@@ -322,13 +592,19 @@ channel.queue_bind(
     queue=queue
 )
 
+# Limitation du nombre de messages en transit sur ce canal
+channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
+# Les messages sont acquittés manuellement
+# sinon RabbitMQ ignore la limite de prefetch
 channel.basic_consume(
     queue=queue,
     on_message_callback=on_message,
-    auto_ack=True
+    auto_ack=False
 )
 
 
 # Lancement de la boucle RabbitMQ intégrée à Tkinter
-root.after(100, rabbitmq_loop)
+start_rabbitmq_loop()
+
 root.mainloop()
@@ -14,11 +14,16 @@ Il ne valide pas.
 Il écoute uniquement les événements diffusés via RabbitMQ.
 """
 
-# Bibliothèque pour communiquer avec RabbitMQ
-import pika
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
 
 # Bibliothèque pour manipuler le format JSON
-import json
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
 
 # Accès au système de fichiers
 import os
@@ -27,12 +32,21 @@ import os
 from datetime import datetime
 
 
-# Adresse du serveur RabbitMQ
-RABBITMQ_HOST = "localhost"
-
 # Exchange commun à tous les services
 EXCHANGE_NAME = "chess.events"
 
+# Queue nommée et durable du service de stockage
+# Elle survit aux redémarrages du service et de RabbitMQ
+# Les événements publiés pendant un arrêt du stockage y sont conservés
+STORAGE_QUEUE = "storage.events"
+
+# Nombre maximal de messages non acquittés confiés au stockage
+# L’ajout d’un événement en mémoire est rapide
+# la limite sert surtout à borner la mémoire lors d’une rafale
+# Elle doit rester supérieure à FLUSH_EVERY
+# car les événements gardés en mémoire ne sont pas encore acquittés
+PREFETCH_COUNT = 50
+
 
 # Dossier de stockage des parties
 # Les fichiers seront créés automatiquement
@@ -44,9 +58,25 @@ if not os.path.exists(STORAGE_DIR):
     os.makedirs(STORAGE_DIR)
 
 
+# Nombre d’événements gardés en mémoire avant écriture sur disque
+# Les écritures sont regroupées au lieu d’être faites à chaque coup
+FLUSH_EVERY = 32
+
+
 # Fichier courant de stockage
 # Un nouveau fichier est créé à chaque partie
-current_file = None
+current_path = None
+
+# Événements reçus mais pas encore écrits sur disque
+current_events = []
+
+# Numéros de livraison de ces événements
+# Ils ne sont acquittés qu’une fois les événements écrits
+current_delivery_tags = []
+
+# Canal RabbitMQ global
+# Il sert à acquitter les événements après leur écriture
+channel = None
 
 
 def open_new_game_file():
@@ -55,89 +85,161 @@ def open_new_game_file():
 
     Le nom du fichier contient un horodatage
     afin d’éviter les collisions.
+
+    Le fichier contient un événement JSON par ligne.
+    Une partie interrompue reste lisible jusqu’au dernier lot écrit.
     """
 
-    global current_file
+    global current_path
 
     # Création d’un nom de fichier unique
     filename = datetime.now().strftime(
-        "game_%Y%m%d_%H%M%S.json"
+        "game_%Y%m%d_%H%M%S.jsonl"
     )
 
     # Chemin complet du fichier
-    path = os.path.join(STORAGE_DIR, filename)
+    current_path = os.path.join(STORAGE_DIR, filename)
+
+    # Création du fichier vide
+    open(current_path, "w", encoding="utf-8").close()
+
+
+def encode_event(event):
+    """
+    Encode un événement en JSON sous forme d’octets.
+    """
+
+    data = json_codec.dumps(event)
+
+    # orjson produit des octets, json produit une chaîne
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    return data
+
+
+def flush_events():
+    """
+    Écrit sur disque les événements gardés en mémoire.
+
+    Tous les événements en attente sont écrits en une seule fois
+    puis acquittés auprès de RabbitMQ.
+    Un arrêt brutal avant l’écriture entraîne leur nouvelle livraison.
+    """
+
+    if current_path is None or not current_events:
+        return
+
+    # Une ligne JSON compacte par événement
+    lines = b"".join(
+        encode_event(event) + b"\n" for event in current_events
+    )
+
+    # Ajout à la fin du fichier de la partie
+    with open(current_path, "ab") as f:
+        f.write(lines)
 
-    # Ouverture du fichier en écriture
-    current_file = open(path, "w", encoding="utf-8")
+    current_events.clear()
 
-    # Initialisation du contenu
-    current_file.write("[\n")
+    # Acquittement des événements désormais sur disque
+    if channel is not None and channel.is_open:
+        for delivery_tag in current_delivery_tags:
+            channel.basic_ack(delivery_tag=delivery_tag)
+
+    current_delivery_tags.clear()
 
 
 def close_game_file():
     """
-    Ferme proprement le fichier de la partie.
+    Termine proprement le fichier de la partie.
+
+    Les derniers événements en attente sont écrits.
     """
 
-    global current_file
+    global current_path
 
-    if current_file:
-        current_file.write("\n]\n")
-        current_file.close()
-        current_file = None
+    flush_events()
+    current_path = None
 
 
-def store_event(event):
+def store_event(event, delivery_tag):
     """
-    Écrit un événement dans le fichier de stockage.
+    Enregistre un événement de la partie.
 
     event est un dictionnaire Python représentant l’événement.
+    delivery_tag est le numéro de livraison du message RabbitMQ.
+
+    L’événement est gardé en mémoire
+    puis écrit sur disque et acquitté avec les suivants.
     """
 
-    global current_file
+    # Aucun fichier ouvert, par exemple après un redémarrage en cours de partie
+    # Les événements restés dans la queue durable sont rangés dans un nouveau fichier
+    if current_path is None:
+        open_new_game_file()
+
+    current_events.append(event)
+    current_delivery_tags.append(delivery_tag)
+
+    # Écriture du lot lorsqu’il est complet
+    if len(current_events) >= FLUSH_EVERY:
+        flush_events()
 
-    if current_file is None:
-        return
 
-    # Conversion de l’événement en JSON lisible
-    json.dump(event, current_file, ensure_ascii=False, indent=2)
+def handle_game_started(event, delivery_tag):
+    """
+    Ouvre le fichier d’une nouvelle partie et y range l’événement.
+    """
+
+    close_game_file()
+    open_new_game_file()
+    store_event(event, delivery_tag)
+
+
+def handle_game_ended(event, delivery_tag):
+    """
+    Range l’événement de fin puis ferme le fichier de la partie.
+    """
 
-    # Ajout d’une virgule pour séparer les événements
-    current_file.write(",\n")
+    store_event(event, delivery_tag)
+    close_game_file()
+
+
+# Fonction de traitement associée à chaque type d’événement conservé
+# Une seule recherche dans le dictionnaire remplace la suite de comparaisons
+# Les événements absents sont acquittés sans décoder leur corps
+HANDLERS = {
+    "game_started": handle_game_started,
+    "move_validated": store_event,
+    "game_ended": handle_game_ended
+}
 
 
 def on_message(ch, method, properties, body):
     """
     Traite les événements reçus depuis RabbitMQ.
 
-    Cette fonction décide
-    quand ouvrir un fichier
-    quoi stocker
-    quand fermer le fichier
+    Cette fonction confie chaque événement conservé
+    à la fonction de traitement de son type.
+    Les autres événements sont acquittés immédiatement.
     """
 
-    global current_file
+    # Événement qui n’est pas conservé
+    if broker.is_ignored_event(properties, HANDLERS):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
 
-    # Décodage du message JSON
-    event = json.loads(body)
+    # Décodage du message
+    event = broker.decode_body(properties, body)
 
-    # Lecture du type d’événement
-    event_type = event.get("event_type")
+    # Recherche du traitement associé au type d’événement
+    handler = HANDLERS.get(event.get("event_type"))
 
-    # Démarrage d’une nouvelle partie
-    if event_type == "game_started":
-        close_game_file()
-        open_new_game_file()
-        store_event(event)
-
-    # Coup validé
-    elif event_type == "move_validated":
-        store_event(event)
-
-    # Fin de partie
-    elif event_type == "game_ended":
-        store_event(event)
-        close_game_file()
+    if handler is None:
+        # Événement non conservé, acquitté immédiatement
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    else:
+        handler(event, method.delivery_tag)
 
 
 def main():
@@ -150,15 +252,12 @@ def main():
     démarre l’écoute
     """
 
-    print("Storage service démarré")
+    global channel
 
-    # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    print("Storage service démarré")
 
-    # Création du canal RabbitMQ
-    channel = connection.channel()
+    # Création du canal RabbitMQ sur la connexion partagée
+    channel = broker.get_channel()
 
     # Déclaration de l’exchange commun
     channel.exchange_declare(
@@ -167,10 +266,13 @@ def main():
         durable=True
     )
 
-    # Création d’une queue temporaire exclusive
+    # Création de la queue durable du stockage
+    # En mode lazy, RabbitMQ garde les messages sur disque plutôt qu’en mémoire
+    # ce qui convient à un long historique en attente
     queue = channel.queue_declare(
-        queue="",
-        exclusive=True
+        queue=STORAGE_QUEUE,
+        durable=True,
+        arguments={"x-queue-mode": "lazy"}
     ).method.queue
 
     # Liaison de la queue à l’exchange
@@ -178,17 +280,26 @@ def main():
         exchange=EXCHANGE_NAME, queue=queue
     )
 
+    # Limitation du nombre de messages en transit sur ce canal
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
     # Abonnement aux messages RabbitMQ
+    # Les messages sont acquittés manuellement
+    # sinon RabbitMQ ignore la limite de prefetch
     channel.basic_consume(
         queue=queue,
         on_message_callback=on_message,
-        auto_ack=True
+        auto_ack=False
     )
 
     print("Storage prêt, en attente des événements")
 
     # Démarrage de la boucle d’écoute
-    channel.start_consuming()
+    try:
+        channel.start_consuming()
+    finally:
+        # Écriture des événements encore en mémoire
+        close_game_file()
 
 
 # Point d’entrée du script
@@ -20,19 +20,60 @@ ils écoutent uniquement les événements diffusés.
 # Bibliothèque pour communiquer avec RabbitMQ
 import pika
 
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
+
 # Bibliothèque pour manipuler le format JSON
-import json
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
 
 # Bibliothèque python-chess pour gérer le plateau et la légalité des coups
 import chess
 
+# Transmission d’arguments aux callbacks différés
+from functools import partial
 
-# Adresse du serveur RabbitMQ
-RABBITMQ_HOST = "localhost"
 
 # Nom de l’exchange commun à tous les services
 EXCHANGE_NAME = "chess.events"
 
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Délai en secondes avant de retraiter un message
+# dont les événements n’ont pas été confirmés par RabbitMQ
+# Évite une boucle serrée de remises en queue si RabbitMQ refuse tout
+PUBLISH_RETRY_DELAY = 1.0
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Messages persistants, conservés sur disque par RabbitMQ
+# dans les queues durables comme celle du stockage
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    event_type: pika.BasicProperties(
+        delivery_mode=2,
+        content_type="application/json",
+        headers={"event_type": event_type}
+    )
+    for event_type in ("move_validated", "game_ended")
+}
+
+# Nombre minimal de demi-coups sans prise ni mouvement de pion
+# pour qu’une nulle puisse être réclamée
+# Une répétition de position ne peut pas survenir plus tôt,
+# même en comptant le coup suivant du joueur
+MIN_HALFMOVES_FOR_CLAIM = 3
+
+# Nombre maximal de messages non acquittés confiés à la validation
+# La vérification d’un coup est rapide, la limite peut être large
+PREFETCH_COUNT = 100
+
 
 # Plateau officiel de la partie
 # Ce plateau est la référence unique de l’état du jeu
@@ -42,6 +83,13 @@ board = chess.Board()
 # Il est utilisé dans le callback
 channel = None
 
+# Résultat d’une fin de partie pas encore confirmée par RabbitMQ
+# None si aucune fin de partie n’est en attente
+pending_game_ended = None
+
+# Message du coup final, acquitté une fois la fin de partie confirmée
+held_delivery_tag = None
+
 
 def publish(channel, event_type, payload):
     """
@@ -50,6 +98,8 @@ def publish(channel, event_type, payload):
     channel est le canal RabbitMQ utilisé.
     event_type décrit le type d’événement.
     payload contient les données associées.
+
+    Retourne True si RabbitMQ a confirmé la réception du message.
     """
 
     # Construction du message
@@ -61,72 +111,205 @@ def publish(channel, event_type, payload):
         "payload": payload
     }
 
+    body = json_codec.dumps(message)
+
     # Envoi du message sur l’exchange
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key="",
-        body=json.dumps(message)
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=PUBLISH_PROPERTIES[event_type]
+            )
+            return True
+        except pika.exceptions.NackError:
+            print("Événement refusé par RabbitMQ, nouvelle tentative")
+
+    print("Événement non publié :", event_type)
+    return False
+
+
+def publish_game_ended():
+    """
+    Diffuse la fin de partie en attente.
+
+    Retourne True si plus aucune fin de partie n’est en attente.
+    """
+
+    global pending_game_ended
+
+    if pending_game_ended is None:
+        return True
+
+    if not publish(channel, "game_ended", {"result": pending_game_ended}):
+        return False
+
+    pending_game_ended = None
+    return True
+
+
+def retry_game_ended():
+    """
+    Retente la diffusion de la fin de partie en attente.
+
+    Le coup final est acquitté dès qu’elle est confirmée,
+    sinon une nouvelle tentative est programmée.
+    """
+
+    global held_delivery_tag
+
+    if not publish_game_ended():
+        channel.connection.call_later(PUBLISH_RETRY_DELAY, retry_game_ended)
+        return
+
+    if held_delivery_tag is not None:
+        channel.basic_ack(delivery_tag=held_delivery_tag)
+        held_delivery_tag = None
+
+
+def requeue_later(ch, delivery_tag):
+    """
+    Remet un message dans la queue après PUBLISH_RETRY_DELAY secondes.
+    """
+
+    ch.connection.call_later(
+        PUBLISH_RETRY_DELAY,
+        partial(ch.basic_nack, delivery_tag=delivery_tag, requeue=True)
     )
 
 
-def on_message(ch, method, properties, body):
+def handle_move_proposed(payload):
     """
-    Traite les événements reçus depuis RabbitMQ.
+    Valide un coup proposé par un joueur.
 
-    Cette fonction est appelée automatiquement
-    à chaque message reçu.
+    payload contient le coup au format UCI.
+
+    Retourne False si le coup doit être validé de nouveau plus tard,
+    lorsque RabbitMQ n’a pas confirmé sa diffusion.
+
+    Une fin de partie non confirmée reste dans pending_game_ended.
     """
 
-    global board
+    global pending_game_ended
 
-    # Décodage du message JSON
-    event = json.loads(body)
+    # Lecture du coup au format UCI
+    uci = payload.get("uci")
 
-    # Lecture du type d’événement
-    event_type = event.get("event_type")
+    # Lecture et vérification de la légalité du coup en une seule étape
+    # Seul ce coup est vérifié, sans générer tous les coups légaux
+    try:
+        move = board.parse_uci(uci)
+    except chess.IllegalMoveError:
+        # Coup illégal selon les règles des échecs
+        print("Coup illégal :", uci)
+        return True
+    except ValueError:
+        # Format de coup invalide
+        print("Coup invalide (format) :", uci)
+        return True
 
-    # Lecture des données associées
-    payload = event.get("payload", {})
+    # Le coup nul "0000" est accepté par parse_uci
+    # mais n’est jamais un coup légal pour un joueur
+    if not move:
+        print("Coup illégal :", uci)
+        return True
 
-    # Réception d’un coup proposé par un joueur
-    if event_type == "move_proposed":
+    # Application du coup sur le plateau officiel
+    board.push(move)
 
-        # Lecture du coup au format UCI
-        uci = payload.get("uci")
+    # Diffusion du coup validé sous sa forme UCI officielle
+    # parse_uci accepte aussi d’autres notations,
+    # par exemple le roque noté roi prend tour (e1h1 pour e1g1)
+    if not publish(channel, "move_validated", {"uci": move.uci()}):
 
-        # Tentative de création du coup
-        try:
-            move = chess.Move.from_uci(uci)
-        except ValueError:
-            # Format de coup invalide
-            print("Coup invalide (format) :", uci)
-            return
+        # Le coup est annulé sur le plateau officiel
+        # pour être validé de nouveau
+        board.pop()
+        return False
+
+    print("Coup validé :", move.uci())
 
-        # Vérification de la légalité du coup
-        if move in board.legal_moves:
+    # Vérification de la fin de partie
+    # Mat, pat, matériel insuffisant et nulles réclamables
+    # sont détectés en un seul appel
+    # Une nulle réclamable (triple répétition, cinquante coups)
+    # suppose plusieurs coups sans prise ni mouvement de pion
+    # Sa recherche, coûteuse, est évitée juste après un tel coup
+    if board.halfmove_clock >= MIN_HALFMOVES_FOR_CLAIM:
+        outcome = board.outcome(claim_draw=True)
+    else:
+        outcome = board.outcome()
 
-            # Application du coup sur le plateau officiel
-            board.push(move)
+    if outcome is not None:
 
-            print("Coup validé :", uci)
+        # Récupération du résultat officiel
+        result = outcome.result()
 
-            # Diffusion du coup validé
-            publish(channel, "move_validated", {"uci": uci})
+        # Diffusion de l’événement de fin de partie
+        # Le coup est déjà sur le plateau officiel et ne peut être revalidé
+        # Une fin de partie refusée est donc gardée en attente
+        pending_game_ended = result
+        publish_game_ended()
 
-            # Vérification de la fin de partie
-            if board.is_game_over():
+        print("Partie terminée :", result)
 
-                # Récupération du résultat officiel
-                result = board.result()
+    return True
 
-                # Diffusion de l’événement de fin de partie
-                publish(channel, "game_ended", {"result": result})
 
-                print("Partie terminée :", result)
+# Fonction de traitement associée à chaque type d’événement
+# Une seule recherche dans le dictionnaire remplace la suite de comparaisons
+# Les événements absents sont acquittés sans décoder leur corps
+HANDLERS = {
+    "move_proposed": handle_move_proposed
+}
 
+
+def on_message(ch, method, properties, body):
+    """
+    Traite les événements reçus depuis RabbitMQ.
+
+    Cette fonction est appelée automatiquement
+    à chaque message reçu.
+
+    Le message n’est acquitté qu’une fois les événements qu’il produit
+    confirmés par RabbitMQ.
+    Sinon il est remis dans la queue après un court délai.
+    """
+
+    global held_delivery_tag
+
+    # Événement sans intérêt pour la validation
+    if broker.is_ignored_event(properties, HANDLERS):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
+
+    # Fin de partie précédente pas encore confirmée
+    # Aucun coup n’est validé avant elle
+    if pending_game_ended is not None:
+        requeue_later(ch, method.delivery_tag)
+        return
+
+    # Décodage du message
+    event_type, payload = broker.decode_event(properties, body)
+
+    # Recherche du traitement associé au type d’événement
+    handler = HANDLERS.get(event_type)
+
+    if handler is None or handler(payload):
+        if pending_game_ended is not None:
+            # Coup diffusé mais fin de partie refusée
+            # Le message reste non acquitté jusqu’à sa confirmation
+            held_delivery_tag = method.delivery_tag
+            ch.connection.call_later(PUBLISH_RETRY_DELAY, retry_game_ended)
         else:
-            # Coup illégal selon les règles des échecs
-            print("Coup illégal :", uci)
+            # Message traité, RabbitMQ peut livrer le suivant
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+    else:
+        # Diffusion non confirmée, le message est remis dans la queue
+        requeue_later(ch, method.delivery_tag)
 
 
 def main():
@@ -143,13 +326,12 @@ def main():
 
     print("Validation service démarré")
 
-    # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    # Création du canal RabbitMQ sur la connexion partagée
+    channel = broker.get_channel()
 
-    # Création du canal RabbitMQ
-    channel = connection.channel()
+    # Activation des confirmations de publication
+    # RabbitMQ confirme chaque message publié sur ce canal
+    channel.confirm_delivery()
 
     # Déclaration de l’exchange commun
     channel.exchange_declare(
@@ -170,11 +352,16 @@ def main():
         queue=queue
     )
 
+    # Limitation du nombre de messages en transit sur ce canal
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
     # Abonnement aux messages RabbitMQ
+    # Les messages sont acquittés manuellement
+    # une fois les événements produits confirmés
     channel.basic_consume(
         queue=queue,
         on_message_callback=on_message,
-        auto_ack=True
+        auto_ack=False
     )
 
     print("Validation prête, en attente des coups")
@@ -0,0 +1,303 @@
+r"""
+web_spectator_service.py
+
+Ce fichier définit un spectateur web léger du projet d’échecs distribué.
+
+Ce service permet de
+suivre la partie depuis un navigateur
+sans interface graphique sur la machine du service
+
+Le plateau est rendu en SVG par python-chess
+puis poussé aux navigateurs connectés à chaque coup validé.
+Aucune image n’est dessinée côté serveur.
+
+Ce service est entièrement passif.
+Il ne joue pas.
+Il ne valide pas.
+Il écoute uniquement les événements RabbitMQ.
+"""
+
+# Connexion partagée à RabbitMQ, commune aux services consommateurs
+import broker
+
+# Bibliothèque python-chess pour gérer le plateau
+import chess
+
+# Rendu SVG du plateau fourni par python-chess
+import chess.svg
+
+# Cache des résultats de fonctions
+from functools import lru_cache
+
+# Serveur HTTP de la bibliothèque standard
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Thread du serveur HTTP et synchronisation avec RabbitMQ
+import threading
+
+# Lecture de l’adresse d’écoute dans l’environnement
+import os
+
+
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
+
+
+# Exchange commun utilisé par tous les services
+EXCHANGE_NAME = "chess.events"
+
+
+# Types d’événements traités par ce service
+# Les autres messages sont acquittés sans décoder leur corps
+HANDLED_EVENTS = frozenset({
+    "game_started",
+    "move_validated"
+})
+
+
+# Adresse et port du serveur HTTP
+# Le serveur n’a pas d’authentification
+# il n’écoute donc que sur la machine locale par défaut
+# SPECTATOR_HTTP_HOST=0.0.0.0 l’ouvre sur toutes les interfaces réseau
+HTTP_HOST = os.environ.get("SPECTATOR_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = 8000
+
+# Taille du plateau SVG en pixels
+BOARD_SIZE = 400
+
+# Nombre maximal de messages non acquittés confiés au spectateur
+# Le rendu SVG est rapide, la limite peut être large
+# Elle borne tout de même la mémoire lors d’une rafale de coups
+PREFETCH_COUNT = 100
+
+
+# Page HTML servie aux navigateurs
+# Elle reçoit le plateau SVG par Server-Sent Events
+# et remplace simplement son contenu à chaque mise à jour
+PAGE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Spectator web – Échecs</title>
+</head>
+<body>
+<div id="board"></div>
+<script>
+const source = new EventSource("/events");
+source.onmessage = (e) => {
+    document.getElementById("board").innerHTML = e.data;
+};
+</script>
+</body>
+</html>
+"""
+
+
+# Plateau local du spectateur
+# Il est synchronisé avec les coups validés
+board = chess.Board()
+
+# Dernier rendu SVG du plateau
+current_svg = ""
+
+# Numéro de version du rendu
+# Il augmente à chaque nouveau rendu
+svg_version = 0
+
+# Condition utilisée pour réveiller les navigateurs en attente
+svg_changed = threading.Condition()
+
+
+def render_board(last_move=None):
+    """
+    Produit le SVG du plateau et réveille les navigateurs connectés.
+
+    last_move est le dernier coup joué, mis en évidence sur le plateau.
+    """
+
+    global current_svg, svg_version
+
+    # Roi en échec mis en évidence
+    check = board.king(board.turn) if board.is_check() else None
+
+    svg = chess.svg.board(
+        board,
+        lastmove=last_move,
+        check=check,
+        size=BOARD_SIZE
+    )
+
+    with svg_changed:
+        current_svg = svg
+        svg_version += 1
+        svg_changed.notify_all()
+
+
+class SpectatorHandler(BaseHTTPRequestHandler):
+    """
+    Traite les requêtes HTTP des navigateurs.
+
+    / renvoie la page HTML
+    /events diffuse le plateau SVG à chaque changement
+    """
+
+    def do_GET(self):
+        if self.path == "/":
+            self.send_page()
+        elif self.path == "/events":
+            self.send_events()
+        else:
+            self.send_error(404)
+
+    def send_page(self):
+        """
+        Envoie la page HTML du spectateur.
+        """
+
+        body = PAGE.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        """
+        Diffuse le plateau au format Server-Sent Events.
+
+        La connexion reste ouverte.
+        Un nouveau rendu est envoyé dès qu’il est disponible.
+        """
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        version = -1
+
+        try:
+            while True:
+                # Attente d’un rendu plus récent que le dernier envoyé
+                with svg_changed:
+                    svg_changed.wait_for(lambda: svg_version != version)
+                    svg = current_svg
+                    version = svg_version
+
+                # Chaque ligne du SVG devient une ligne "data:"
+                # Le navigateur les recolle avec des retours à la ligne
+                lines = "".join(
+                    f"data: {line}\n" for line in svg.splitlines()
+                )
+                self.wfile.write((lines + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError):
+            # Le navigateur a fermé la page
+            pass
+
+    def log_message(self, format, *args):
+        # Pas de journal pour chaque requête
+        pass
+
+
+def on_message(ch, method, properties, body):
+    """
+    Traite les événements reçus depuis RabbitMQ.
+
+    Cette fonction met à jour
+    le plateau local
+    le rendu SVG diffusé aux navigateurs
+    """
+
+    # Événement sans effet sur le plateau
+    if broker.is_ignored_event(properties, HANDLED_EVENTS):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
+
+    event_type, payload = broker.decode_event(properties, body)
+
+    if event_type == "game_started":
+        board.reset()
+        render_board()
+
+    elif event_type == "move_validated":
+        move = parse_uci(payload["uci"])
+        board.push(move)
+        render_board(move)
+
+    # Message traité, RabbitMQ peut livrer le suivant
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def main():
+    """
+    Point d’entrée principal du spectateur web.
+
+    Cette fonction
+    démarre le serveur HTTP
+    se connecte à RabbitMQ
+    s’abonne aux événements
+    démarre l’écoute
+    """
+
+    print("Web spectator démarré")
+
+    # Rendu initial du plateau
+    render_board()
+
+    # Serveur HTTP dans un thread séparé
+    # Chaque navigateur est servi par son propre thread
+    server = ThreadingHTTPServer((HTTP_HOST, HTTP_PORT), SpectatorHandler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"Plateau disponible sur http://{HTTP_HOST}:{HTTP_PORT}/")
+
+    # Création du canal RabbitMQ sur la connexion partagée
+    channel = broker.get_channel()
+
+    # Déclaration de l’exchange commun
+    channel.exchange_declare(
+        exchange=EXCHANGE_NAME,
+        exchange_type="fanout",
+        durable=True
+    )
+
+    # Création d’une queue temporaire exclusive
+    queue = channel.queue_declare(
+        queue="",
+        exclusive=True
+    ).method.queue
+
+    # Liaison de la queue à l’exchange
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=queue
+    )
+
+    # Limitation du nombre de messages en transit sur ce canal
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
+    # Abonnement aux messages RabbitMQ
+    # Les messages sont acquittés manuellement
+    # sinon RabbitMQ ignore la limite de prefetch
+    channel.basic_consume(
+        queue=queue,
+        on_message_callback=on_message,
+        auto_ack=False
+    )
+
+    print("Web spectator prêt, en attente des coups")
+
+    # Démarrage de la boucle d’écoute
+    channel.start_consuming()
+
+
+# Point d’entrée du script
+if __name__ == "__main__":
+    main()
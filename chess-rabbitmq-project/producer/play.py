@@ -0,0 +1,61 @@
+r"""
+play.py
+
+Ce fichier lance les deux producteurs de coups dans un seul processus.
+
+Le joueur humain joue les BLANCS, l’IA joue les NOIRS.
+
+Il permet de
+partager une seule connexion TCP entre les deux producteurs
+ouvrir des canaux séparés pour chacun sur cette connexion
+traiter leurs événements dans une seule boucle
+
+Les deux producteurs restent utilisables séparément
+avec producer_human.py et producer_ai.py.
+"""
+
+# Bibliothèque pour communiquer avec RabbitMQ
+import pika
+
+# Producteurs lancés dans ce processus
+import producer_ai
+import producer_human
+
+
+# Adresse du serveur RabbitMQ
+RABBITMQ_HOST = "localhost"
+
+
+def main():
+    """
+    Point d’entrée commun aux deux producteurs.
+
+    Cette fonction
+    ouvre la connexion partagée
+    prépare l’IA puis le joueur humain
+    lance la boucle d’écoute
+    """
+
+    # Connexion unique au serveur RabbitMQ
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(host=RABBITMQ_HOST)
+    )
+
+    # L’IA s’abonne en premier
+    # pour recevoir le début de partie annoncé par le joueur humain
+    producer_ai.setup(connection)
+    producer_human.setup(connection)
+
+    # Boucle commune aux deux producteurs
+    # Stockfish et la saisie au clavier travaillent dans leurs propres threads
+    # Le programme s’arrête à la fin de la partie ou avec Ctrl+C
+    try:
+        while True:
+            connection.process_data_events(time_limit=None)
+    finally:
+        producer_ai.shutdown()
+
+
+# Point d’entrée du script
+if __name__ == "__main__":
+    main()
@@ -20,10 +20,12 @@ Il attend toujours une confirmation officielle.
 import pika
 
 # Bibliothèque pour manipuler le format JSON
-import json
-
-# Bibliothèque standard pour gérer les pauses temporelles
-import time
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
 
 # Bibliothèque python-chess pour gérer le plateau et les coups
 import chess
@@ -31,12 +33,35 @@ import chess
 # Interface avec le moteur Stockfish
 import chess.engine
 
-# Utilisé pour générer des horodatages UTC
-from datetime import datetime, timezone
+# Bibliothèque psutil, lecture de la mémoire disponible
+# Sans elle, la table de hachage de Stockfish garde une taille fixe
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Utilisé pour générer des horodatages
+import time
 
 # Accès au système de fichiers
 import os
 
+# Utilisé pour transmettre des arguments aux callbacks
+# et pour mettre en cache les résultats de fonctions
+from functools import partial, lru_cache
+
+# Thread dédié au calcul des coups par Stockfish
+from concurrent.futures import ThreadPoolExecutor
+
+# Dictionnaire ordonné utilisé comme cache LRU
+from collections import OrderedDict
+
+
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
+
 
 # Adresse du serveur RabbitMQ
 RABBITMQ_HOST = "localhost"
@@ -44,6 +69,36 @@ RABBITMQ_HOST = "localhost"
 # Exchange commun à tous les services
 EXCHANGE_NAME = "chess.events"
 
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Messages non persistants (delivery_mode=1)
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    event_type: pika.BasicProperties(
+        delivery_mode=1,
+        content_type="application/json",
+        headers={"event_type": event_type}
+    )
+    for event_type in ("move_proposed",)
+}
+
+# Encodage des messages compressés avec zstd
+# Seules les longues explications le sont, ce producteur les ignore
+ZSTD_CONTENT_ENCODING = "zstd"
+
+# Types d’événements suivis par ce producteur
+# Les autres messages, dont ses propres coups proposés renvoyés par le fanout,
+# sont ignorés sans décoder leur corps
+HANDLED_EVENTS = frozenset({
+    "game_started",
+    "move_validated",
+    "game_ended"
+})
+
 
 # Chemin vers l’exécutable Stockfish
 # Le chemin doit être exact
@@ -57,6 +112,51 @@ STOCKFISH_PATH = (
 # Ici l’IA joue les NOIRS
 AI_COLOR = chess.BLACK
 
+# Temps de réflexion accordé à Stockfish pour chaque coup, en secondes
+THINK_TIME = 0.7
+
+# Profondeur de recherche au-delà de laquelle Stockfish s’arrête
+# avant la fin du temps accordé
+# Les positions simples sont jouées plus vite, les autres gardent THINK_TIME
+THINK_DEPTH = 18
+
+# Ressources accordées au Stockfish de l’IA
+# Le Stockfish de l’analyse tourne en même temps sur la même machine
+# et l’IA réfléchit aussi pendant le tour du joueur humain (ponder)
+# Par défaut, chaque moteur reçoit donc la moitié des ressources
+# que la machine peut consacrer aux deux moteurs
+# AI_ENGINE_THREADS et AI_ENGINE_HASH_MB changent ce partage
+
+# Taille de la table de hachage interne de Stockfish en Mo
+# Elle est conservée d’une partie à l’autre
+# La valeur par défaut de Stockfish (16 Mo) se remplit trop vite
+# Un huitième de la mémoire disponible, au plus 2 Go, si psutil est installé
+# sinon 256 Mo
+if psutil is not None:
+    DEFAULT_ENGINE_HASH_MB = max(
+        16,
+        min(2048, psutil.virtual_memory().available // (8 * 1024 * 1024))
+    )
+else:
+    DEFAULT_ENGINE_HASH_MB = 256
+
+ENGINE_HASH_MB = int(
+    os.environ.get("AI_ENGINE_HASH_MB", DEFAULT_ENGINE_HASH_MB)
+)
+
+# Nombre de threads de recherche de Stockfish
+# Un cœur est laissé à RabbitMQ et aux autres services
+# les autres sont partagés entre les deux moteurs
+ENGINE_THREADS = int(
+    os.environ.get(
+        "AI_ENGINE_THREADS",
+        max(1, ((os.cpu_count() or 2) - 1) // 2)
+    )
+)
+
+# Nombre maximal de positions conservées dans le cache des coups
+MOVE_CACHE_MAX_ENTRIES = 100_000
+
 
 # Plateau local de l’IA
 # Il est synchronisé avec les coups validés
@@ -70,8 +170,29 @@ waiting_validation = False
 game_over = False
 
 
-# Canal RabbitMQ global
+# Connexion et canaux RabbitMQ globaux
+# channel reçoit les événements, publish_channel publie
+connection = None
 channel = None
+publish_channel = None
+
+# Instance du moteur Stockfish
+engine = None
+
+# Thread unique exécutant les calculs de Stockfish
+# La boucle RabbitMQ reste libre pendant la réflexion
+# (heartbeats, fin de partie, nouvelle partie)
+executor = ThreadPoolExecutor(max_workers=1)
+
+# Calcul de coup en cours dans le thread de Stockfish
+# None lorsque l’IA ne réfléchit pas
+thinking = None
+
+# Coups déjà joués par l’IA pendant la session
+# Clé : clé de transposition python-chess de la position
+# Valeur : coup calculé par Stockfish
+# Les positions les moins récemment utilisées sont évincées en premier
+move_cache = OrderedDict()
 
 
 def publish(event_type, payload):
@@ -80,6 +201,8 @@ def publish(event_type, payload):
 
     event_type indique le type d’événement.
     payload contient les données associées.
+
+    Retourne True si RabbitMQ a confirmé la réception du message.
     """
 
     # Construction du message
@@ -87,20 +210,188 @@ def publish(event_type, payload):
         # Type d’événement
         "event_type": event_type,
 
-        # Horodatage UTC
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        # Horodatage en nanosecondes depuis le 1er janvier 1970 (UTC)
+        # Un simple entier, sans objet date à créer ni texte à formater
+        # La conversion en date est laissée aux lecteurs qui en ont besoin
+        "timestamp": time.time_ns(),
 
         # Données spécifiques
         "payload": payload
     }
 
+    body = json_codec.dumps(message)
+
     # Envoi du message à tous les services abonnés
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key="",
-        body=json.dumps(message)
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            publish_channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=PUBLISH_PROPERTIES[event_type]
+            )
+            return True
+        except pika.exceptions.NackError:
+            print("Événement refusé par RabbitMQ, nouvelle tentative")
+
+    print("Événement non publié :", event_type)
+    return False
+
+
+def start_thinking():
+    """
+    Lance le calcul du prochain coup si c’est au tour de l’IA.
+
+    Le calcul se fait dans le thread de Stockfish.
+    Le coup est publié par on_move_computed dans le thread de RabbitMQ.
+    Un coup déjà calculé pour la même position est publié directement.
+    """
+
+    global thinking, waiting_validation
+
+    if game_over or waiting_validation or board.turn != AI_COLOR:
+        return
+
+    # Un seul calcul à la fois
+    if thinking is not None:
+        return
+
+    # Position déjà jouée pendant la session
+    # Deux ordres de coups menant à la même position partagent la clé
+    # Le coup mémorisé est repris sans appeler Stockfish
+    # Une position répétée dans la partie est toujours recalculée
+    # car Stockfish tient compte des répétitions pour éviter la nulle
+    key = board._transposition_key()
+    cached = move_cache.get(key)
+
+    if cached is not None and not board.is_repetition(2):
+        move_cache.move_to_end(key)
+
+        # Stockfish ne sera pas appelé pour ce coup
+        # sa réflexion sur le coup précédent doit être arrêtée ici
+        stop_pondering()
+
+        if publish("move_proposed", {"uci": cached.uci()}):
+            waiting_validation = True
+            return
+
+        # Envoi refusé, le coup est recalculé par Stockfish
+        del move_cache[key]
+
+    # La copie évite de partager le plateau entre les threads
+    # Elle sert aussi à vérifier que la position n’a pas changé entre-temps
+    position = board.copy()
+
+    # ponder : après avoir donné son coup, Stockfish continue de réfléchir
+    # sur la réponse qu’il attend de l’adversaire (go ponder)
+    # Si l’adversaire joue ce coup, le calcul suivant reprend
+    # cette réflexion (ponderhit) au lieu de repartir de zéro
+    # sinon python-chess l’arrête et lance une nouvelle recherche
+    # game : python-chess envoie ucinewgame, qui vide la table
+    # de transposition, seulement quand cette valeur change
+    # La position de départ sert de clé : les parties suivantes
+    # profitent des ouvertures déjà analysées
+    thinking = executor.submit(
+        engine.play,
+        position,
+        chess.engine.Limit(time=THINK_TIME, depth=THINK_DEPTH),
+        ponder=True,
+        game=position.root().fen()
     )
 
+    thinking.add_done_callback(partial(on_think_done, position=position))
+
+
+def stop_pondering():
+    """
+    Arrête la réflexion de Stockfish pendant le tour de l’adversaire.
+
+    Sans nouvel appel à engine.play, Stockfish réfléchirait
+    jusqu’à la fin de la partie en occupant ses threads.
+    """
+
+    # python-chess envoie stop à un moteur en réflexion
+    # avant toute nouvelle commande, ici un simple ping (isready)
+    # Le ping passe par le thread de Stockfish, après un éventuel calcul en cours
+    executor.submit(engine.ping)
+
+
+def on_think_done(future, position):
+    """
+    Appelée par le thread de Stockfish quand le coup est calculé.
+
+    pika n’étant pas thread-safe,
+    la publication est confiée au thread de RabbitMQ.
+    """
+
+    connection.add_callback_threadsafe(
+        partial(on_move_computed, future, position)
+    )
+
+
+def on_move_computed(future, position):
+    """
+    Publie le coup calculé par Stockfish.
+
+    Le coup est abandonné si la partie a changé pendant le calcul,
+    par exemple après une fin de partie ou une nouvelle partie.
+    Il est aussi abandonné si Stockfish a échoué.
+    """
+
+    global thinking, waiting_validation
+
+    thinking = None
+
+    # Position différente, le coup calculé n’est plus valable
+    if game_over or waiting_validation or board != position:
+        start_thinking()
+        return
+
+    # Récupération du coup calculé
+    # Une erreur de Stockfish (arrêt du moteur, erreur de protocole)
+    # ne doit pas interrompre la boucle RabbitMQ
+    # Le calcul sera relancé au prochain événement de la partie
+    try:
+        move = future.result().move
+    except Exception as error:
+        print("Calcul du coup impossible :", error)
+        return
+
+    # Mémorisation du coup pour cette position
+    key = position._transposition_key()
+    move_cache[key] = move
+    move_cache.move_to_end(key)
+
+    # Éviction de la position la plus ancienne si le cache est plein
+    if len(move_cache) > MOVE_CACHE_MAX_ENTRIES:
+        move_cache.popitem(last=False)
+
+    # Envoi du coup proposé
+    # L’IA attend ensuite la validation officielle
+    # Si l’envoi échoue, le coup est recalculé
+    if publish("move_proposed", {"uci": move.uci()}):
+        waiting_validation = True
+    else:
+        start_thinking()
+
+
+def is_ignored_event(properties):
+    """
+    Indique si un message peut être ignoré sans décoder son corps.
+
+    Le type d’événement est lu dans les en-têtes AMQP du message.
+    Un message sans cet en-tête est toujours décodé.
+    """
+
+    headers = properties.headers
+
+    if not headers or "event_type" not in headers:
+        return False
+
+    return headers["event_type"] not in HANDLED_EVENTS
+
 
 def on_message(ch, method, properties, body):
     """
@@ -113,8 +404,16 @@ def on_message(ch, method, properties, body):
 
     global waiting_validation, game_over
 
+    # Événement sans intérêt pour ce producteur
+    if is_ignored_event(properties):
+        return
+
+    # Message compressé, sans intérêt pour ce producteur
+    if properties.content_encoding == ZSTD_CONTENT_ENCODING:
+        return
+
     # Décodage du message JSON
-    event = json.loads(body)
+    event = json_codec.loads(body)
 
     # Lecture du type d’événement
     event_type = event.get("event_type")
@@ -130,7 +429,7 @@ def on_message(ch, method, properties, body):
 
     # Coup validé par le service de validation
     elif event_type == "move_validated":
-        move = chess.Move.from_uci(payload["uci"])
+        move = parse_uci(payload["uci"])
         board.push(move)
 
         # L’IA peut rejouer après validation
@@ -138,22 +437,30 @@ def on_message(ch, method, properties, body):
 
     # Fin de partie
     elif event_type == "game_ended":
-        print("Partie terminée")
+        print("Partie terminée, en attente d’une nouvelle partie")
         game_over = True
 
+        # Plus aucun coup à préparer pour cette partie
+        stop_pondering()
 
-def main():
+    # Calcul du coup suivant si c’est au tour de l’IA
+    start_thinking()
+
+
+def setup(shared_connection):
     """
-    Fonction principale de l’intelligence artificielle.
+    Prépare l’IA sur une connexion RabbitMQ déjà ouverte.
+
+    shared_connection peut être partagée avec d’autres producteurs
+    lancés dans le même processus.
 
     Elle réalise les actions suivantes
     initialisation de Stockfish
-    connexion à RabbitMQ
-    écoute des événements
-    calcul et proposition des coups
+    ouverture des canaux
+    abonnement aux événements
     """
 
-    global channel, waiting_validation, game_over
+    global connection, channel, publish_channel, engine
 
     print("IA prête (joue les NOIRS)")
 
@@ -166,14 +473,29 @@ def main():
     # Lancement du moteur Stockfish
     engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
 
+    # Configuration de la table de hachage et des threads de Stockfish
+    # adaptée à la machine
+    engine.configure({
+        "Hash": ENGINE_HASH_MB,
+        "Threads": ENGINE_THREADS
+    })
+
     # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    # Les callbacks l’utilisent pour recevoir les coups calculés
+    connection = shared_connection
 
-    # Création du canal RabbitMQ
+    # Création du canal de réception des événements
     channel = connection.channel()
 
+    # Canal réservé aux publications, sur la même connexion
+    # La réception des événements et l’envoi des coups
+    # ne se partagent pas le même canal
+    publish_channel = connection.channel()
+
+    # Activation des confirmations de publication
+    # RabbitMQ confirme chaque message publié sur ce canal
+    publish_channel.confirm_delivery()
+
     # Déclaration de l’exchange commun
     channel.exchange_declare(
         exchange=EXCHANGE_NAME,
@@ -200,38 +522,62 @@ def main():
         auto_ack=True
     )
 
-    # Boucle principale de l’IA
-    while not game_over:
-        # Traitement non bloquant des messages RabbitMQ
-        connection.process_data_events(time_limit=0.1)
-
-        # Attente de la validation du coup précédent
-        if waiting_validation:
-            time.sleep(0.1)
-            continue
-
-        # L’IA ne joue que lorsque c’est son tour
-        if board.turn != AI_COLOR:
-            time.sleep(0.1)
-            continue
-
-        # Calcul du meilleur coup avec Stockfish
-        result = engine.play(
-            board,
-            chess.engine.Limit(time=0.7)
-        )
+    # Premier coup si c’est déjà au tour de l’IA
+    start_thinking()
 
-        # Récupération du coup calculé
-        move = result.move
 
-        # Envoi du coup proposé
-        publish("move_proposed", {"uci": move.uci()})
+def shutdown():
+    """
+    Arrête proprement l’IA.
 
-        # L’IA attend la validation officielle
-        waiting_validation = True
+    Le calcul en cours est attendu
+    puis la réflexion de Stockfish est arrêtée
+    et le moteur est fermé.
+    """
+
+    executor.shutdown(wait=True, cancel_futures=True)
+
+    if engine is not None:
+        # Le ping envoie stop si Stockfish réfléchit encore
+        try:
+            engine.ping()
+        except chess.engine.EngineTerminatedError:
+            pass
+
+        engine.quit()
+
+
+def main():
+    """
+    Fonction principale de l’intelligence artificielle.
 
-    # Fermeture propre du moteur Stockfish
-    engine.quit()
+    Elle réalise les actions suivantes
+    connexion à RabbitMQ
+    préparation de l’IA
+    écoute des événements
+    calcul et proposition des coups
+    """
+
+    # Connexion au serveur RabbitMQ, propre à ce producteur
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(host=RABBITMQ_HOST)
+    )
+
+    setup(connection)
+
+    # Boucle principale de l’IA
+    # Elle ne fait que traiter les messages RabbitMQ
+    # Stockfish réfléchit dans son propre thread
+    # et ses coups sont publiés depuis cette boucle
+    # L’appel bloque jusqu’à l’arrivée d’un message ou d’un coup calculé
+    # L’IA reste lancée d’une partie à l’autre
+    # avec le même processus Stockfish et sa table de transposition
+    # Elle s’arrête avec Ctrl+C
+    try:
+        while True:
+            connection.process_data_events(time_limit=None)
+    finally:
+        shutdown()
 
 
 # Point d’entrée du script
@@ -20,13 +20,31 @@ Cette responsabilité appartient au service de validation.
 import pika
 
 # Bibliothèque utilisée pour encoder et décoder le JSON
-import json
+# orjson est utilisée si elle est installée car elle est écrite en C
+# sinon le module json standard prend le relais
+try:
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
 
 # Bibliothèque python-chess pour manipuler un plateau d’échecs
 import chess
 
-# Utilisé pour générer un horodatage UTC
-from datetime import datetime, timezone
+# Utilisé pour générer des horodatages
+import time
+
+# Cache des résultats de fonctions
+# et transmission d’arguments aux callbacks
+from functools import lru_cache, partial
+
+# Thread dédié à la saisie des coups au clavier
+import threading
+
+
+# Lecture d’un coup au format UCI avec mise en cache
+# Le nombre de chaînes UCI possibles est petit
+# chaque chaîne n’est donc analysée qu’une seule fois
+parse_uci = lru_cache(maxsize=65536)(chess.Move.from_uci)
 
 
 # Adresse du serveur RabbitMQ
@@ -36,6 +54,36 @@ RABBITMQ_HOST = "localhost"
 # Nom de l’exchange commun utilisé pour diffuser les événements
 EXCHANGE_NAME = "chess.events"
 
+# Nombre de tentatives de publication
+# lorsque RabbitMQ refuse un message (confirmation négative)
+PUBLISH_ATTEMPTS = 3
+
+# Propriétés AMQP des événements publiés, préparées une seule fois
+# Messages non persistants (delivery_mode=1)
+# Le type d’événement est repris dans les en-têtes
+# pour que les consommateurs filtrent sans décoder le corps
+PUBLISH_PROPERTIES = {
+    event_type: pika.BasicProperties(
+        delivery_mode=1,
+        content_type="application/json",
+        headers={"event_type": event_type}
+    )
+    for event_type in ("game_started", "move_proposed")
+}
+
+# Encodage des messages compressés avec zstd
+# Seules les longues explications le sont, ce producteur les ignore
+ZSTD_CONTENT_ENCODING = "zstd"
+
+# Types d’événements suivis par ce producteur
+# Les autres messages, dont ses propres coups proposés renvoyés par le fanout,
+# sont ignorés sans décoder leur corps
+HANDLED_EVENTS = frozenset({
+    "game_started",
+    "move_validated",
+    "game_ended"
+})
+
 
 # Couleur jouée par le joueur humain
 # Ici le joueur joue les BLANCS
@@ -47,9 +95,22 @@ HUMAN_COLOR = chess.WHITE
 # et à vérifier la légalité locale des coups
 board = chess.Board()
 
-# Canal RabbitMQ
-# Il sera initialisé dans la fonction main
+# Indique si le joueur attend la validation de son coup
+waiting_validation = False
+
+# Indique si une saisie au clavier est en cours
+reading = False
+
+# Numéro de la partie en cours
+# Il change à chaque game_started, même si le plateau reste identique
+game_number = 0
+
+# Connexion et canaux RabbitMQ
+# Ils seront initialisés dans la fonction main
+# channel reçoit les événements, publish_channel publie
+connection = None
 channel = None
+publish_channel = None
 
 
 def publish(event_type, payload):
@@ -62,6 +123,8 @@ def publish(event_type, payload):
     Cette fonction est utilisée pour
     démarrer une partie
     proposer un coup
+
+    Retourne True si RabbitMQ a confirmé la réception du message.
     """
 
     # Construction du message sous forme de dictionnaire Python
@@ -69,22 +132,153 @@ def publish(event_type, payload):
         # Type de l’événement
         "event_type": event_type,
 
-        # Horodatage UTC au format ISO 8601
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        # Horodatage en nanosecondes depuis le 1er janvier 1970 (UTC)
+        # Un simple entier, sans objet date à créer ni texte à formater
+        # La conversion en date est laissée aux lecteurs qui en ont besoin
+        "timestamp": time.time_ns(),
 
         # Données spécifiques à l’événement
         "payload": payload
     }
 
+    body = json_codec.dumps(message)
+
     # Publication du message sur l’exchange RabbitMQ
     # Le fanout diffuse le message à tous les services abonnés
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key="",
-        body=json.dumps(message)
+    # Avec les confirmations, l’appel attend l’accord de RabbitMQ
+    # Un message refusé est renvoyé
+    for attempt in range(PUBLISH_ATTEMPTS):
+        try:
+            publish_channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key="",
+                body=body,
+                properties=PUBLISH_PROPERTIES[event_type]
+            )
+            return True
+        except pika.exceptions.NackError:
+            print("Événement refusé par RabbitMQ, nouvelle tentative")
+
+    print("Événement non publié :", event_type)
+    return False
+
+
+def is_ignored_event(properties):
+    """
+    Indique si un message peut être ignoré sans décoder son corps.
+
+    Le type d’événement est lu dans les en-têtes AMQP du message.
+    Un message sans cet en-tête est toujours décodé.
+    """
+
+    headers = properties.headers
+
+    if not headers or "event_type" not in headers:
+        return False
+
+    return headers["event_type"] not in HANDLED_EVENTS
+
+
+def request_move():
+    """
+    Demande un coup au joueur si c’est son tour.
+
+    La saisie se fait dans un thread dédié.
+    """
+
+    global reading
+
+    if waiting_validation or board.turn != HUMAN_COLOR:
+        return
+
+    # Une seule saisie à la fois
+    if reading:
+        return
+
+    reading = True
+
+    # Position au début de la saisie
+    # Le coup tapé ne sera envoyé que si elle n’a pas changé entre-temps
+    position = (game_number, board.fen())
+
+    # Thread démon : il ne bloque pas l’arrêt du programme
+    threading.Thread(target=read_move, args=(position,), daemon=True).start()
+
+
+def read_move(position):
+    """
+    Lit un coup au clavier dans le thread de saisie.
+
+    La boucle RabbitMQ reste active pendant la réflexion du joueur.
+    pika n’étant pas thread-safe,
+    le coup saisi est confié au thread de RabbitMQ
+    avec la position à laquelle il a été demandé.
+    """
+
+    try:
+        move_uci = input("Ton coup : ").strip()
+    except EOFError:
+        # Entrée standard fermée
+        move_uci = None
+
+    connection.add_callback_threadsafe(
+        partial(on_move_entered, move_uci, position)
     )
 
 
+def on_move_entered(move_uci, position):
+    """
+    Vérifie puis envoie le coup saisi par le joueur.
+
+    Un nouveau coup est demandé si celui-ci est refusé
+    ou s’il a été tapé pour une position qui n’existe plus.
+    """
+
+    global reading, waiting_validation
+
+    reading = False
+
+    # Plus rien à lire au clavier
+    # Le programme s’arrête proprement
+    if move_uci is None:
+        print("Saisie terminée")
+        exit(0)
+
+    # La partie a changé pendant la saisie
+    if waiting_validation or board.turn != HUMAN_COLOR:
+        return
+
+    # Nouvelle partie ou nouveau coup pendant la saisie
+    # Le coup tapé ne correspond plus au plateau
+    if position != (game_number, board.fen()):
+        print("Position changée, coup ignoré")
+        request_move()
+        return
+
+    # Vérification du format UCI
+    try:
+        move = parse_uci(move_uci)
+    except ValueError:
+        print("Format invalide")
+        request_move()
+        return
+
+    # Vérification de la légalité du coup
+    # Seul ce coup est vérifié, sans générer tous les coups légaux
+    if not board.is_legal(move):
+        print("Coup illégal")
+        request_move()
+        return
+
+    # Envoi du coup proposé au service de validation
+    # Le joueur attend ensuite la validation officielle
+    # Si l’envoi échoue, le coup est redemandé
+    if publish("move_proposed", {"uci": move_uci}):
+        waiting_validation = True
+    else:
+        request_move()
+
+
 def on_message(ch, method, properties, body):
     """
     Fonction appelée automatiquement à chaque message reçu.
@@ -93,8 +287,18 @@ def on_message(ch, method, properties, body):
     avec la partie officielle validée.
     """
 
+    global waiting_validation, game_number
+
+    # Événement sans intérêt pour ce producteur
+    if is_ignored_event(properties):
+        return
+
+    # Message compressé, sans intérêt pour ce producteur
+    if properties.content_encoding == ZSTD_CONTENT_ENCODING:
+        return
+
     # Décodage du message JSON reçu
-    event = json.loads(body)
+    event = json_codec.loads(body)
 
     # Lecture du type d’événement
     event_type = event.get("event_type")
@@ -106,46 +310,63 @@ def on_message(ch, method, properties, body):
     # Le plateau local est réinitialisé
     if event_type == "game_started":
         board.reset()
+        game_number += 1
 
     # Coup validé par le service de validation
     # Le coup est appliqué sur le plateau local
     elif event_type == "move_validated":
-        move = chess.Move.from_uci(payload["uci"])
+        move = parse_uci(payload["uci"])
         board.push(move)
 
+        # Le joueur peut rejouer après validation
+        waiting_validation = False
+
     # Fin de partie
     # Le programme s’arrête proprement
     elif event_type == "game_ended":
         print("Partie terminée")
         exit(0)
 
+    # Saisie du coup suivant si c’est au tour du joueur
+    request_move()
 
-def main():
+
+def setup(shared_connection):
     """
-    Fonction principale du joueur humain.
+    Prépare le joueur humain sur une connexion RabbitMQ déjà ouverte.
+
+    shared_connection peut être partagée avec d’autres producteurs
+    lancés dans le même processus.
 
     Elle réalise les actions suivantes
-    connexion à RabbitMQ
+    ouverture des canaux
     abonnement aux événements
     initialisation de la partie
-    saisie des coups au clavier
     """
 
-    # Le canal RabbitMQ est global
-    global channel
+    # La connexion et les canaux RabbitMQ sont globaux
+    global connection, channel, publish_channel
 
     # Messages affichés pour l’utilisateur
     print("Joueur humain prêt (BLANCS)")
     print("Entre les coups au format UCI (ex: e2e4)")
 
     # Connexion au serveur RabbitMQ
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
+    # Le thread de saisie l’utilise pour transmettre les coups
+    connection = shared_connection
 
-    # Création du canal de communication RabbitMQ
+    # Création du canal de réception des événements
     channel = connection.channel()
 
+    # Canal réservé aux publications, sur la même connexion
+    # La réception des événements et l’envoi des coups
+    # ne se partagent pas le même canal
+    publish_channel = connection.channel()
+
+    # Activation des confirmations de publication
+    # RabbitMQ confirme chaque message publié sur ce canal
+    publish_channel.confirm_delivery()
+
     # Déclaration de l’exchange commun
     # fanout signifie diffusion vers tous les consommateurs
     channel.exchange_declare(
@@ -177,31 +398,35 @@ def main():
     # Envoi de l’événement de démarrage de partie
     publish("game_started", {})
 
-    # Boucle principale du programme
-    while True:
-        # Traitement non bloquant des événements RabbitMQ
-        connection.process_data_events(time_limit=0.1)
+    # Premier coup demandé au joueur
+    request_move()
 
-        # Le joueur peut jouer uniquement si c’est son tour
-        if board.turn == HUMAN_COLOR:
 
-            # Lecture du coup entré par l’utilisateur
-            move_uci = input("Ton coup : ").strip()
+def main():
+    """
+    Fonction principale du joueur humain.
 
-            # Vérification du format UCI
-            try:
-                move = chess.Move.from_uci(move_uci)
-            except ValueError:
-                print("Format invalide")
-                continue
+    Elle réalise les actions suivantes
+    connexion à RabbitMQ
+    préparation du joueur
+    saisie des coups au clavier
+    """
 
-            # Vérification de la légalité du coup
-            if move not in board.legal_moves:
-                print("Coup illégal")
-                continue
+    # Connexion au serveur RabbitMQ, propre à ce producteur
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(host=RABBITMQ_HOST)
+    )
+
+    setup(connection)
 
-            # Envoi du coup proposé au service de validation
-            publish("move_proposed", {"uci": move_uci})
+    # Boucle principale du programme
+    # Elle ne fait que traiter les messages RabbitMQ
+    # Les coups sont saisis dans un thread dédié
+    # et envoyés depuis cette boucle
+    # Les heartbeats continuent pendant la réflexion du joueur
+    # L’appel bloque jusqu’à l’arrivée d’un message ou d’un coup saisi
+    while True:
+        connection.process_data_events(time_limit=None)
 
 
 # Point d’entrée du script
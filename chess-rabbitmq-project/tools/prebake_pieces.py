@@ -0,0 +1,68 @@
+r"""
+prebake_pieces.py
+
+Ce fichier prépare les images des pièces pour le spectateur.
+
+Les images PNG d’origine sont redimensionnées une seule fois
+à la taille utilisée par spectator_service.py
+puis enregistrées dans un sous-dossier cache_<taille>.
+
+Le spectateur charge ensuite directement ces images,
+sans conversion ni redimensionnement au démarrage.
+
+Ce script est à relancer si SQUARE_SIZE change.
+"""
+
+# Bibliothèque pour manipuler les images
+from PIL import Image
+
+# Accès au système de fichiers
+import os
+
+
+# Dossier contenant les images PNG des pièces d’échecs
+# Il doit être identique à celui de spectator_service.py
+PIECES_PATH = r"C:\Users\mario\OneDrive\Images\cburnett"
+
+# Taille d’une case du plateau en pixels
+# Elle doit être identique à celle de spectator_service.py
+SQUARE_SIZE = 64
+
+
+# Noms des images des pièces
+PIECE_FILES = [
+    "wP.png", "wR.png", "wN.png", "wB.png", "wQ.png", "wK.png",
+    "bP.png", "bR.png", "bN.png", "bB.png", "bQ.png", "bK.png",
+]
+
+
+def main():
+    """
+    Redimensionne les images des pièces et les enregistre dans le cache.
+    """
+
+    # Dossier de destination propre à la taille des cases
+    cache_dir = os.path.join(PIECES_PATH, f"cache_{SQUARE_SIZE}")
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    for filename in PIECE_FILES:
+        # Ouverture et conversion de l’image d’origine
+        img = Image.open(os.path.join(PIECES_PATH, filename)).convert("RGBA")
+
+        # Redimensionnement à la taille affichée par le spectateur
+        img = img.resize(
+            (SQUARE_SIZE - 8, SQUARE_SIZE - 8),
+            Image.LANCZOS
+        )
+
+        # Enregistrement dans le cache
+        img.save(os.path.join(cache_dir, filename))
+
+        print("Image préparée :", filename)
+
+
+# Point d’entrée du script
+if __name__ == "__main__":
+    main()